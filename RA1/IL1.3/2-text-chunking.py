@@ -1,10 +1,153 @@
 import streamlit as st
+import numpy as np
+import argparse
+import bisect
+import collections
+import difflib
+import hashlib
+import json
+import os
 import re
+import shutil
+import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
-st.set_page_config(page_title="Text Chunking Demo", page_icon="📝", layout="wide")
+# tiktoken es opcional: sin él se usa una aproximación offline del número de tokens
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-def chunking_text(text, chunk_size=200, overlap=50):
+_WORD_RE = re.compile(r'\S+')
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\n')
+
+# --- Segmentador de oraciones ---
+# Tratamientos y títulos: siempre van seguidos de un nombre, nunca cierran oración
+_TITLE_ABBREVIATIONS = [
+    'sr', 'sra', 'srta', 'sres', 'dr', 'dra', 'lic', 'ing', 'prof', 'arq', 'mtro', 'mtra',
+    'don', 'dña', 'ud', 'uds', 'mr', 'mrs', 'ms', 'st', 'jr', 'gen', 'gob', 'pres',
+]
+# Abreviaturas que pueden cerrar una oración: solo se ignoran si lo que sigue
+# empieza en minúscula o con un número
+_ABBREVIATIONS = [
+    'etc', 'ej', 'p', 'pág', 'pag', 'págs', 'núm', 'num', 'no', 'nro', 'art', 'cap', 'vol',
+    'aprox', 'fig', 'tel', 'av', 'avda', 'dpto', 'depto', 'cía', 'ca', 'vs', 'approx',
+    'dept', 'inc', 'ltd', 'co', 'corp', 'e.g', 'i.e', 'cf', 'al', 'pp', 'ed', 'eds',
+]
+_TERMINATORS = '.!?…'
+_CLOSERS = '"\'”’»)\]'
+
+def _lookbehind(words):
+    """Lookbehind que reconoce cualquiera de las palabras (en minúscula, capitalizada o mayúscula)"""
+    by_length = {}
+    for word in words:
+        for variant in (word, word.capitalize(), word.upper()):
+            by_length.setdefault(len(variant), set()).add(re.escape(variant))
+    # Cada lookbehind debe tener ancho fijo, así que se agrupan por longitud
+    return '|'.join(
+        rf"(?<=\b(?:{'|'.join(sorted(variants))}))" for _, variants in sorted(by_length.items())
+    )
+
+# Una oración empieza en un carácter no blanco y avanza por tramos sin signos
+# terminales; un signo terminal no corta la oración si va seguido de otro
+# carácter no blanco (decimales como 3.5, siglas) o cierra una abreviatura.
+# Los signos sueltos entre espacios forman su propia oración, de modo que los
+# finales de oración no dependen de desde dónde se empiece a segmentar.
+_TITLE_LOOKBEHIND = _lookbehind(_TITLE_ABBREVIATIONS)
+_ABBREVIATION_LOOKBEHIND = _lookbehind(_ABBREVIATIONS)
+_INITIAL_LOOKBEHIND = r'(?<=\b[A-ZÁÉÍÓÚÑ])'
+
+_SENTENCE_RE = re.compile(
+    rf"""[{_TERMINATORS}]+[{_CLOSERS}]*(?=\s|\Z)
+  | \S[^{_TERMINATORS}]*
+    (?:
+        (?:
+            [{_TERMINATORS}]+(?![{_CLOSERS}]*(?:\s|\Z))
+          | (?:{_TITLE_LOOKBEHIND})\.
+          | (?:{_ABBREVIATION_LOOKBEHIND})\.(?=\s+[a-záéíóúüñ0-9])
+          | {_INITIAL_LOOKBEHIND}\.
+        )
+        [^{_TERMINATORS}]*
+    )*
+    (?:[{_TERMINATORS}]+[{_CLOSERS}]*)?""",
+    re.VERBOSE,
+)
+
+# Comprueba si la secuencia de signos terminales que empieza en una posición
+# cierra una oración, con los mismos criterios que _SENTENCE_RE
+_SENTENCE_END_RE = re.compile(
+    rf"""(?!(?:{_TITLE_LOOKBEHIND})\.)
+    (?!(?:{_ABBREVIATION_LOOKBEHIND})\.\s+[a-záéíóúüñ0-9])
+    (?!{_INITIAL_LOOKBEHIND}\.)
+    [{_TERMINATORS}]+[{_CLOSERS}]*(?=\s|\Z)""",
+    re.VERBOSE,
+)
+
+def _sentence_spans(text):
+    """Lista de offsets (inicio, fin) de cada oración del texto"""
+    spans = [match.span() for match in _SENTENCE_RE.finditer(text)]
+    if spans and spans[-1][1] == len(text):
+        # La última oración puede no tener signo final y arrastrar espacios
+        spans[-1] = _strip_span(text, *spans[-1])
+    return spans
+
+def iter_sentence_spans(text):
+    """Produce los offsets (inicio, fin) de cada oración del texto en una sola pasada"""
+    for match in _SENTENCE_RE.finditer(text):
+        start, end = match.span()
+        if end == len(text):
+            start, end = _strip_span(text, start, end)
+        yield start, end
+
+def count_sentences(text):
+    """Número de oraciones del texto según iter_sentence_spans"""
+    return len(_SENTENCE_RE.findall(text))
+
+class Chunk:
+    """Chunk representado por offsets sobre el texto original.
+
+    El texto solo se materializa al acceder a `text`; mientras tanto el chunk
+    ocupa tres referencias y sirve como procedencia (offsets) del fragmento.
+    """
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def span(self):
+        return self.start, self.end
+
+    @property
+    def text(self):
+        return self.source[self.start:self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"Chunk(start={self.start}, end={self.end})"
+
+    def digest(self):
+        """Hash del contenido, independiente de la posición del chunk"""
+        return _content_hash(self.text)
+
+def _content_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def chunking_text(text, chunk_size=200, overlap=50, as_spans=False):
     """Divide el texto en chunks con solapamiento"""
+    if as_spans:
+        return [Chunk(text, start, end) for start, end in iter_chunking_text([text], chunk_size, overlap, as_spans=True)]
+    
     words = text.split()
     chunks = []
     
@@ -23,10 +166,14 @@ def chunking_text(text, chunk_size=200, overlap=50):
     
     return chunks
 
-def chunking_by_sentences(text, max_sentences=5, overlap_sentences=1):
+def chunking_by_sentences(text, max_sentences=5, overlap_sentences=1, as_spans=False):
     """Divide el texto por oraciones"""
-    sentences = re.split(r'[.!?]+', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
+    if as_spans:
+        return [Chunk(text, start, end) for start, end in iter_chunking_by_sentences([text], max_sentences, overlap_sentences, as_spans=True)]
+    
+    sentences = _SENTENCE_RE.findall(text)
+    if sentences:
+        sentences[-1] = sentences[-1].rstrip()
     
     chunks = []
     
@@ -38,7 +185,7 @@ def chunking_by_sentences(text, max_sentences=5, overlap_sentences=1):
     
     for i in range(0, len(sentences), step):
         chunk_sentences = sentences[i:i + max_sentences]
-        chunk = '. '.join(chunk_sentences) + '.'
+        chunk = ' '.join(chunk_sentences)
         chunks.append(chunk)
         
         if i + max_sentences >= len(sentences):
@@ -46,14 +193,20 @@ def chunking_by_sentences(text, max_sentences=5, overlap_sentences=1):
     
     return chunks
 
-def chunking_by_paragraphs(text):
+def chunking_by_paragraphs(text, as_spans=False):
     """Divide el texto por párrafos"""
+    if as_spans:
+        return [Chunk(text, start, end) for start, end in iter_chunking_by_paragraphs([text], as_spans=True)]
+    
     paragraphs = text.split('\n\n')
     chunks = [p.strip() for p in paragraphs if p.strip()]
     return chunks
 
-def chunking_by_characters(text, chunk_size=500, overlap=100):
+def chunking_by_characters(text, chunk_size=500, overlap=100, as_spans=False):
     """Divide el texto por número de caracteres"""
+    if as_spans:
+        return [Chunk(text, start, end) for start, end in iter_chunking_by_characters([text], chunk_size, overlap, as_spans=True)]
+    
     chunks = []
     
     # Validar que el solapamiento sea menor que el tamaño del chunk
@@ -71,7 +224,396 @@ def chunking_by_characters(text, chunk_size=500, overlap=100):
     
     return chunks
 
+# --- Variantes en streaming ---
+# Consumen un archivo abierto o cualquier iterable de líneas y producen los
+# mismos chunks que las funciones anteriores, pero solo mantienen en memoria
+# la ventana de solapamiento entre un chunk y el siguiente. Con as_spans=True
+# producen tuplas (inicio, fin) con offsets absolutos de caracteres en el flujo.
+
+# Caracteres del final del texto pendiente que se examinan junto con cada
+# fragmento nuevo: bastan para separadores y finales de oración que cruzan
+# fragmentos, así que el texto pendiente no se vuelve a recorrer en cada línea
+_SCAN_LOOKBACK = 64
+# Contexto mínimo delante de un signo terminal para que los lookbehind de las
+# abreviaturas no vean una palabra cortada por el inicio de la ventana
+_LOOKBEHIND_CONTEXT = 16
+_TERMINATOR_RE = re.compile(rf'[{_TERMINATORS}]')
+_WHITESPACE_RE = re.compile(r'\s')
+
+def _iter_words(lines):
+    """Produce las palabras de un iterable de fragmentos de texto"""
+    pending = []  # Fragmentos de una palabra que puede continuar en el siguiente
+    for piece in lines:
+        if pending and piece and not _WHITESPACE_RE.search(piece):
+            pending.append(piece)
+            continue
+        if pending:
+            piece = ''.join(pending) + piece
+        words = piece.split()
+        # Una palabra al final del fragmento puede continuar en el siguiente
+        pending = [words.pop()] if words and not piece[-1].isspace() else []
+        yield from words
+    if pending:
+        yield ''.join(pending)
+
+def _iter_match_spans(lines, pattern, with_text=False):
+    """Offsets de las coincidencias de un patrón de palabras (como _WORD_RE) en el flujo"""
+    pending = []  # Fragmentos desde el inicio de la coincidencia que toca el final
+    base = 0  # Offset absoluto del inicio del texto pendiente
+    for piece in lines:
+        if pending and pattern.fullmatch(piece):
+            # La coincidencia pendiente sigue a lo largo de todo el fragmento
+            pending.append(piece)
+            continue
+        buffer = ''.join(pending) + piece
+        cut = len(buffer)
+        for match in pattern.finditer(buffer):
+            # Una coincidencia que toca el final puede continuar en el siguiente fragmento
+            if match.end() == len(buffer):
+                cut = match.start()
+                break
+            if with_text:
+                yield base + match.start(), base + match.end(), match.group()
+            else:
+                yield base + match.start(), base + match.end()
+        pending = [buffer[cut:]] if cut < len(buffer) else []
+        base += cut
+    buffer = ''.join(pending)
+    for match in pattern.finditer(buffer):
+        if with_text:
+            yield base + match.start(), base + match.end(), match.group()
+        else:
+            yield base + match.start(), base + match.end()
+
+def _strip_span(buffer, start, end):
+    """Ajusta (start, end) para excluir los espacios en los bordes"""
+    while start < end and buffer[start].isspace():
+        start += 1
+    while end > start and buffer[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def _iter_split_spans(lines, separator, with_text=False):
+    """Offsets de los segmentos no vacíos entre coincidencias de `separator`.
+
+    Los fragmentos sin separador (mirando también los últimos caracteres
+    pendientes) se acumulan sin concatenar; el texto pendiente solo se une y
+    se recorre cuando aparece un separador.
+    """
+    pending = []
+    tail = ''
+    base = 0
+    for piece in lines:
+        window = tail + piece
+        if not separator.search(window):
+            pending.append(piece)
+            tail = window[-_SCAN_LOOKBACK:]
+            continue
+        buffer = ''.join(pending) + piece
+        pos = 0
+        for match in separator.finditer(buffer):
+            start, end = _strip_span(buffer, pos, match.start())
+            if start < end:
+                yield (base + start, base + end, buffer[start:end]) if with_text else (base + start, base + end)
+            pos = match.end()
+        rest = buffer[pos:]
+        pending = [rest] if rest else []
+        tail = rest[-_SCAN_LOOKBACK:]
+        base += pos
+    buffer = ''.join(pending)
+    start, end = _strip_span(buffer, 0, len(buffer))
+    if start < end:
+        yield (base + start, base + end, buffer[start:end]) if with_text else (base + start, base + end)
+
+def _has_sentence_end(text, start=0):
+    """Indica si el texto tiene, a partir de `start`, un final de oración seguido de más texto.
+
+    Un final sin nada detrás todavía puede cambiar (p. ej. "etc. " antes de
+    una minúscula), así que se decide cuando llega el texto siguiente.
+    """
+    for match in _TERMINATOR_RE.finditer(text, start):
+        end = _SENTENCE_END_RE.match(text, match.start())
+        if end and _WORD_RE.search(text, end.end()):
+            return True
+    return False
+
+def _iter_sentences(lines, with_text=False):
+    """Segmenta el flujo en oraciones con el mismo criterio que iter_sentence_spans.
+
+    La última oración de cada fragmento se retiene hasta ver el siguiente,
+    porque su final (p. ej. "3." seguido de "5") todavía puede cambiar. Los
+    fragmentos sin ningún posible final de oración se acumulan sin volver a
+    segmentar, de modo que un texto sin signos terminales cuesta tiempo lineal.
+    """
+    pending = []
+    tail = ''
+    base = 0
+    for piece in lines:
+        window = tail + piece
+        # Si `tail` es solo el final del texto pendiente, sus primeros caracteres son contexto
+        context = _LOOKBEHIND_CONTEXT if len(tail) == _SCAN_LOOKBACK else 0
+        if not _has_sentence_end(window, context):
+            pending.append(piece)
+            tail = window[-_SCAN_LOOKBACK:]
+            continue
+        buffer = ''.join(pending) + piece
+        previous = None
+        for match in _SENTENCE_RE.finditer(buffer):
+            if previous is not None:
+                start, end = previous.span()
+                yield (base + start, base + end, buffer[start:end]) if with_text else (base + start, base + end)
+            previous = match
+        cut = previous.start() if previous is not None else len(buffer)
+        rest = buffer[cut:]
+        pending = [rest] if rest else []
+        tail = rest[-_SCAN_LOOKBACK:]
+        base += cut
+    buffer = ''.join(pending)
+    for start, end in iter_sentence_spans(buffer):
+        yield (base + start, base + end, buffer[start:end]) if with_text else (base + start, base + end)
+
+def _iter_windows(items, size, overlap):
+    """Agrupa un flujo de elementos en ventanas de `size` con `overlap` elementos repetidos"""
+    if overlap >= size:
+        overlap = size - 1
+    step = max(1, size - overlap)
+
+    window = []
+    fresh = False  # Hay elementos en la ventana que aún no se han emitido
+    for item in items:
+        window.append(item)
+        fresh = True
+        if len(window) == size:
+            yield window
+            window = window[step:]
+            fresh = False
+    if fresh:
+        yield window
+
+def _iter_window_spans(spans, size, overlap):
+    """Une ventanas de spans consecutivos en un único span por chunk"""
+    for window in _iter_windows(spans, size, overlap):
+        yield window[0][0], window[-1][1]
+
+def iter_chunking_text(lines, chunk_size=200, overlap=50, as_spans=False):
+    """Versión en streaming de chunking_text"""
+    if as_spans:
+        yield from _iter_window_spans(_iter_match_spans(lines, _WORD_RE), chunk_size, overlap)
+        return
+    for window in _iter_windows(_iter_words(lines), chunk_size, overlap):
+        yield ' '.join(window)
+
+def _iter_text_chunks(lines, chunk_size=200, overlap=50):
+    """Como iter_chunking_text, pero produce (inicio, fin, texto) en una sola pasada"""
+    for window in _iter_windows(_iter_match_spans(lines, _WORD_RE, with_text=True), chunk_size, overlap):
+        yield window[0][0], window[-1][1], ' '.join(word for _, _, word in window)
+
+def iter_chunking_by_sentences(lines, max_sentences=5, overlap_sentences=1, as_spans=False):
+    """Versión en streaming de chunking_by_sentences"""
+    if as_spans:
+        yield from _iter_window_spans(_iter_sentences(lines), max_sentences, overlap_sentences)
+        return
+    sentences = (sentence for _, _, sentence in _iter_sentences(lines, with_text=True))
+    for window in _iter_windows(sentences, max_sentences, overlap_sentences):
+        yield ' '.join(window)
+
+def _iter_sentence_chunks(lines, max_sentences=5, overlap_sentences=1):
+    """Como iter_chunking_by_sentences, pero produce (inicio, fin, texto) en una sola pasada"""
+    for window in _iter_windows(_iter_sentences(lines, with_text=True), max_sentences, overlap_sentences):
+        yield window[0][0], window[-1][1], ' '.join(sentence for _, _, sentence in window)
+
+def iter_chunking_by_paragraphs(lines, as_spans=False):
+    """Versión en streaming de chunking_by_paragraphs"""
+    if as_spans:
+        yield from _iter_split_spans(lines, _PARAGRAPH_SPLIT_RE)
+        return
+    for _, _, paragraph in _iter_split_spans(lines, _PARAGRAPH_SPLIT_RE, with_text=True):
+        yield paragraph
+
+def iter_chunking_by_characters(lines, chunk_size=500, overlap=100, as_spans=False):
+    """Versión en streaming de chunking_by_characters"""
+    if overlap >= chunk_size:
+        overlap = chunk_size - 1
+    step = max(1, chunk_size - overlap)
+
+    if as_spans:
+        total = 0
+        start = 0
+        emitted_end = 0
+        for piece in lines:
+            total += len(piece)
+            while total - start >= chunk_size:
+                yield start, start + chunk_size
+                emitted_end = start + chunk_size
+                start += step
+        if total > emitted_end:
+            yield start, total
+        return
+
+    for _, _, chunk in _iter_character_chunks(lines, chunk_size, overlap):
+        yield chunk
+
+def _iter_character_chunks(lines, chunk_size=500, overlap=100):
+    """Chunks de caracteres como (inicio, fin, texto)"""
+    if overlap >= chunk_size:
+        overlap = chunk_size - 1
+    step = max(1, chunk_size - overlap)
+
+    buffer = ''
+    base = 0
+    covered = 0  # Caracteres del buffer ya incluidos en algún chunk emitido
+    for piece in lines:
+        buffer += piece
+        pos = 0
+        while len(buffer) - pos >= chunk_size:
+            yield base + pos, base + pos + chunk_size, buffer[pos:pos + chunk_size]
+            pos += step
+            covered = chunk_size - step
+        buffer = buffer[pos:]
+        base += pos
+    if len(buffer) > covered:
+        yield base, base + len(buffer), buffer
+
+# --- Chunking por presupuesto de tokens ---
+# El coste y la latencia de los embeddings dependen de tokens, no de palabras:
+# se empaquetan oraciones (o párrafos) completos hasta llenar el presupuesto.
+
+# Cada palabra cuenta un token por cada 4 caracteres y cada signo de puntuación
+# cuenta uno; suele sobreestimar ligeramente a los tokenizadores BPE de OpenAI
+_APPROX_TOKEN_RE = re.compile(r'\w{1,4}|[^\w\s]')
+
+def estimate_tokens(text):
+    """Aproximación rápida y offline del número de tokens de un texto"""
+    return len(_APPROX_TOKEN_RE.findall(text))
+
+def get_token_counter(model="text-embedding-3-small"):
+    """Devuelve un contador de tokens exacto para el modelo si tiktoken está disponible"""
+    if tiktoken is None:
+        return estimate_tokens
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception:
+        # Modelo desconocido o sin acceso para descargar el vocabulario
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+def _split_into_sentences(start, unit):
+    """Parte una unidad demasiado grande en oraciones (inicio, fin, texto)"""
+    for sentence_start, sentence_end in iter_sentence_spans(unit):
+        yield start + sentence_start, start + sentence_end, unit[sentence_start:sentence_end]
+
+def _split_into_words(start, unit):
+    """Parte una unidad demasiado grande en palabras (inicio, fin, texto)"""
+    for match in _WORD_RE.finditer(unit):
+        yield start + match.start(), start + match.end(), match.group()
+
+def _pack_units(units, max_tokens, token_counter, separator, splitters=(_split_into_words,)):
+    """Agrupa unidades (inicio, fin, texto) de forma voraz sin superar max_tokens.
+
+    Produce pares (separador, unidades): una unidad que por sí sola supera el
+    presupuesto se parte con el primer elemento de `splitters` (p. ej. un párrafo en
+    oraciones y, si aún no cabe, en palabras) y sus trozos se unen con un espacio.
+    Una única palabra más larga que el presupuesto se emite sola.
+    """
+    packed = []
+    packed_tokens = 0
+    for start, end, unit in units:
+        tokens = token_counter(unit)
+        if tokens > max_tokens:
+            if packed:
+                yield separator, packed
+                packed, packed_tokens = [], 0
+            if splitters:
+                yield from _pack_units(splitters[0](start, unit), max_tokens, token_counter, ' ', splitters[1:])
+            else:
+                yield separator, [(start, end, unit)]
+            continue
+        if packed and packed_tokens + tokens > max_tokens:
+            yield separator, packed
+            packed, packed_tokens = [], 0
+        packed.append((start, end, unit))
+        packed_tokens += tokens
+    if packed:
+        yield separator, packed
+
+def chunking_by_tokens(text, max_tokens=512, unit="sentences", token_counter=None, as_spans=False):
+    """Empaqueta oraciones o párrafos completos en chunks de hasta max_tokens tokens"""
+    token_counter = token_counter or estimate_tokens
+    if unit == "paragraphs":
+        spans, separator = iter_chunking_by_paragraphs([text], as_spans=True), '\n\n'
+        splitters = (_split_into_sentences, _split_into_words)
+    else:
+        spans, separator, splitters = _sentence_spans(text), ' ', (_split_into_words,)
+    units = ((start, end, text[start:end]) for start, end in spans)
+
+    chunks = []
+    for joiner, packed in _pack_units(units, max_tokens, token_counter, separator, splitters):
+        if as_spans:
+            chunks.append(Chunk(text, packed[0][0], packed[-1][1]))
+        else:
+            chunks.append(joiner.join(unit for _, _, unit in packed))
+    return chunks
+
+def _iter_token_packs(lines, max_tokens, unit, token_counter):
+    """Pares (separador, unidades) de cada chunk de tokens del flujo"""
+    token_counter = token_counter or estimate_tokens
+    if unit == "paragraphs":
+        units, separator = _iter_split_spans(lines, _PARAGRAPH_SPLIT_RE, with_text=True), '\n\n'
+        splitters = (_split_into_sentences, _split_into_words)
+    else:
+        units, separator, splitters = _iter_sentences(lines, with_text=True), ' ', (_split_into_words,)
+    return _pack_units(units, max_tokens, token_counter, separator, splitters)
+
+def iter_chunking_by_tokens(lines, max_tokens=512, unit="sentences", token_counter=None, as_spans=False):
+    """Versión en streaming de chunking_by_tokens"""
+    for joiner, packed in _iter_token_packs(lines, max_tokens, unit, token_counter):
+        if as_spans:
+            yield packed[0][0], packed[-1][1]
+        else:
+            yield joiner.join(unit for _, _, unit in packed)
+
+def _iter_token_chunks(lines, max_tokens=512, unit="sentences", token_counter=None):
+    """Como iter_chunking_by_tokens, pero produce (inicio, fin, texto) en una sola pasada"""
+    for joiner, packed in _iter_token_packs(lines, max_tokens, unit, token_counter):
+        yield packed[0][0], packed[-1][1], joiner.join(unit for _, _, unit in packed)
+
+_UI_METHODS = {
+    "Por palabras": "words",
+    "Por oraciones": "sentences",
+    "Por párrafos": "paragraphs",
+    "Por caracteres": "characters",
+    "Por tokens": "tokens",
+    "Recursivo": "recursive",
+}
+
+@st.cache_data(max_entries=16, show_spinner="Calculando chunks...")
+def _compute_chunks(text_hash, method, params, dedup_threshold, _text):
+    """Chunks y estadísticas de un texto.
+
+    La caché se indexa por el hash del texto (`_text` no se hashea) junto al método
+    y sus parámetros; las longitudes de cada chunk se guardan en arrays de NumPy
+    y las estadísticas se calculan sobre ellos.
+    """
+    params = dict(params)
+    if method == "tokens":
+        params["token_counter"] = get_token_counter() if params.pop("exact_tokens") else estimate_tokens
+    chunks = _list_chunkers()[method](_text, **params)
+    dropped = 0
+    if dedup_threshold is not None:
+        chunks, dropped = dedup_chunks(chunks, dedup_threshold)
+
+    count = len(chunks)
+    return {
+        "chunks": chunks,
+        "words": np.fromiter((len(chunk.split()) for chunk in chunks), dtype=np.int64, count=count),
+        "chars": np.fromiter(map(len, chunks), dtype=np.int64, count=count),
+        "sentences": np.fromiter(map(count_sentences, chunks), dtype=np.int64, count=count),
+        "dropped": dropped,
+        "text_words": len(_text.split()),
+    }
+
 def main():
+    st.set_page_config(page_title="Text Chunking Demo", page_icon="📝", layout="wide")
     st.title("📝 Demostrador de División de Texto en Chunks")
     st.write("Herramienta para visualizar diferentes métodos de división de texto")
     
@@ -80,7 +622,7 @@ def main():
     
     chunking_method = st.sidebar.selectbox(
         "Método de división:",
-        ["Por palabras", "Por oraciones", "Por párrafos", "Por caracteres"]
+        ["Por palabras", "Por oraciones", "Por párrafos", "Por caracteres", "Por tokens", "Recursivo"]
     )
     
     # Configuraciones específicas según el método
@@ -99,7 +641,27 @@ def main():
         overlap = st.sidebar.slider("Solapamiento (caracteres):", 0, chunk_size-1, min(100, chunk_size-1), 50)
         if overlap >= chunk_size:
             st.sidebar.warning("⚠️ El solapamiento debe ser menor que el tamaño del chunk")
+    elif chunking_method == "Por tokens":
+        max_tokens = st.sidebar.slider("Presupuesto de tokens por chunk:", 64, 8000, 512, 64)
+        token_unit = st.sidebar.radio("Unidad a empaquetar:", ["Oraciones", "Párrafos"])
+        exact_tokens = st.sidebar.checkbox(
+            "Contar con tiktoken",
+            value=False,
+            disabled=tiktoken is None,
+            help="Si tiktoken no está instalado se usa una aproximación offline"
+        )
+    elif chunking_method == "Recursivo":
+        chunk_size = st.sidebar.slider("Tamaño máximo del chunk (caracteres):", 100, 4000, 500, 100)
+        overlap = st.sidebar.slider("Solapamiento (caracteres):", 0, chunk_size-1, 0, 50)
     
+    dedup = st.sidebar.checkbox(
+        "Eliminar casi duplicados",
+        value=False,
+        help="Descarta los chunks muy parecidos a uno anterior antes de generar embeddings"
+    )
+    if dedup:
+        dedup_threshold = st.sidebar.slider("Similitud mínima para descartar:", 0.5, 1.0, 0.9, 0.05)
+
     # Botón de calcular
     calculate_button = st.sidebar.button("🔄 Calcular Chunks", type="primary", use_container_width=True)
     
@@ -154,38 +716,81 @@ Inmediatamente después de escurrir, añade los espaguetis calientes a la sarté
     with col2:
         st.header("🔪 Chunks Generados")
         
+        # Parámetros del método seleccionado, hashables para la caché
+        if chunking_method in ("Por palabras", "Por caracteres", "Recursivo"):
+            params = (("chunk_size", chunk_size), ("overlap", overlap))
+        elif chunking_method == "Por oraciones":
+            params = (("max_sentences", max_sentences), ("overlap_sentences", overlap_sentences))
+        elif chunking_method == "Por tokens":
+            params = (
+                ("max_tokens", max_tokens),
+                ("unit", "paragraphs" if token_unit == "Párrafos" else "sentences"),
+                ("exact_tokens", exact_tokens),
+            )
+        else:
+            params = ()
+        request = (
+            _content_hash(text_input).hex(),
+            _UI_METHODS[chunking_method],
+            params,
+            dedup_threshold if dedup else None,
+        )
+
         if text_input.strip() and calculate_button:
-            # Generar chunks según el método seleccionado
-            if chunking_method == "Por palabras":
-                chunks = chunking_text(text_input, chunk_size, overlap)
-            elif chunking_method == "Por oraciones":
-                chunks = chunking_by_sentences(text_input, max_sentences, overlap_sentences)
-            elif chunking_method == "Por párrafos":
-                chunks = chunking_by_paragraphs(text_input)
-            else:  # Por caracteres
-                chunks = chunking_by_characters(text_input, chunk_size, overlap)
+            # Se guarda la petición calculada para que la paginación no pierda los resultados
+            st.session_state.chunking_request = request
+            st.session_state.chunking_page = 1
+
+        if text_input.strip() and st.session_state.get("chunking_request") == request:
+            result = _compute_chunks(*request, text_input)
+            chunks, words = result["chunks"], result["words"]
             
             # Mostrar estadísticas
             st.subheader("📊 Estadísticas")
             col_stats1, col_stats2, col_stats3 = st.columns(3)
             
             with col_stats1:
-                st.metric("Total chunks", len(chunks))
+                dropped = result["dropped"]
+                st.metric("Total chunks", len(chunks), f"-{dropped} duplicados" if dropped else None, delta_color="off")
             with col_stats2:
-                st.metric("Palabras originales", len(text_input.split()))
+                st.metric("Palabras originales", result["text_words"])
             with col_stats3:
-                avg_chunk_size = sum(len(chunk.split()) for chunk in chunks) / len(chunks) if chunks else 0
+                avg_chunk_size = words.mean() if chunks else 0
                 st.metric("Promedio palabras/chunk", f"{avg_chunk_size:.1f}")
             
             # Mostrar chunks
             st.subheader("📋 Chunks Generados")
+
+            # Solo se crean widgets para la página visible
+            col_page_size, col_page = st.columns(2)
+            with col_page_size:
+                page_size = st.selectbox("Chunks por página:", [10, 25, 50, 100], index=1)
+            pages = max(1, -(-len(chunks) // page_size))
+            st.session_state.chunking_page = min(st.session_state.get("chunking_page", 1), pages)
+            with col_page:
+                page = st.number_input(f"Página (de {pages}):", 1, pages, key="chunking_page")
+            first = (page - 1) * page_size
             
-            for i, chunk in enumerate(chunks):
-                with st.expander(f"Chunk {i+1} ({len(chunk.split())} palabras, {len(chunk)} caracteres)"):
+            for i in range(first, min(first + page_size, len(chunks))):
+                chunk = chunks[i]
+                with st.expander(f"Chunk {i+1} ({words[i]} palabras, {result['chars'][i]} caracteres)"):
                     st.write(chunk)
                     
                     # Mostrar información adicional del chunk
-                    st.caption(f"Palabras: {len(chunk.split())} | Caracteres: {len(chunk)} | Oraciones: {len(re.split(r'[.!?]+', chunk))}")
+                    st.caption(f"Palabras: {words[i]} | Caracteres: {result['chars'][i]} | Oraciones: {result['sentences'][i]}")
+
+            with st.expander("🗂️ Tabla con todos los chunks"):
+                st.dataframe(
+                    {
+                        "Chunk": range(1, len(chunks) + 1),
+                        "Palabras": words,
+                        "Caracteres": result["chars"],
+                        "Oraciones": result["sentences"],
+                        "Inicio": [chunk[:80] for chunk in chunks],
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                )
         elif not text_input.strip():
             st.info("👆 Ingresa un texto en la columna izquierda para ver los chunks generados")
         else:
@@ -215,6 +820,16 @@ Inmediatamente después de escurrir, añade los espaguetis calientes a la sarté
         - División basada en número de caracteres
         - Control preciso del tamaño
         - Útil cuando hay limitaciones de longitud estrictas
+        
+        **Por tokens:**
+        - Empaqueta oraciones o párrafos completos hasta un presupuesto de tokens
+        - Aprovecha la entrada del modelo de embeddings con menos llamadas
+        - Ideal para controlar coste y latencia de la API
+        
+        **Recursivo:**
+        - Corta en el mayor límite posible: párrafo, oración, palabra o carácter
+        - Garantiza un tamaño máximo en caracteres, como RecursiveCharacterTextSplitter
+        - Buen punto de partida general para RAG
         """)
     
     with st.expander("🎯 Cuándo usar cada método"):
@@ -223,8 +838,866 @@ Inmediatamente después de escurrir, añade los espaguetis calientes a la sarté
         - **Artículos y ensayos**: Por oraciones o párrafos
         - **Textos técnicos**: Por párrafos para mantener conceptos completos
         - **APIs con límites de caracteres**: Por caracteres
+        - **APIs con límites de tokens**: Por tokens
         - **Análisis de sentimientos**: Por oraciones para mantener contexto emocional
         """)
 
+# --- Chunking recursivo ---
+# Equivalente a RecursiveCharacterTextSplitter: cada chunk termina en el mayor
+# límite posible (párrafo, después oración, palabra y, como último recurso,
+# carácter) sin superar chunk_size caracteres. Los límites de párrafo se indexan
+# una vez y se recorren con un puntero que solo avanza; los de oración y palabra
+# se buscan hacia atrás desde el final de la ventana. Ningún fragmento se vuelve
+# a dividir, así que el coste total es lineal en el tamaño del texto.
+
+_LAST_SPACE_RE = re.compile(r'.*\s', re.DOTALL)
+_LAST_TERMINATOR_RE = re.compile(rf'.*[{_TERMINATORS}]', re.DOTALL)
+_SPACE_RE = re.compile(r'\s*')
+_NEXT_SPACE_RE = re.compile(r'\s')
+# Caracteres tras un límite que el segmentador de oraciones necesita ver
+_BOUNDARY_LOOKAHEAD = 64
+
+def _last_sentence_end(text, floor, limit):
+    """Último final de oración en (floor, limit], o None si no hay ninguno"""
+    end = limit
+    while True:
+        match = _LAST_TERMINATOR_RE.match(text, floor, end)
+        if not match:
+            return None
+        run = match.end() - 1
+        while run > floor and text[run - 1] in _TERMINATORS:
+            run -= 1
+        boundary = _SENTENCE_END_RE.match(text, run)
+        if boundary and floor < boundary.end() <= limit:
+            return boundary.end()
+        end = run
+
+def _recursive_spans(text, chunk_size, overlap, cut=0, pos=0):
+    """Produce (inicio, fin, corte, siguiente_inicio) de cada chunk recursivo del texto.
+
+    Cuando se continúa un texto ya troceado, `cut` es el corte del chunk anterior y
+    `pos` el inicio del siguiente; el texto anterior a `pos` solo sirve de contexto
+    para los lookbehind de abreviaturas.
+    """
+    if overlap >= chunk_size:
+        overlap = chunk_size - 1
+    n = len(text)
+    paragraph_cuts = array('q', [match.start() for match in _PARAGRAPH_SPLIT_RE.finditer(text)])
+    pointer = -1
+
+    pos = _SPACE_RE.match(text, pos).end()
+    while pos < n:
+        # Con solapamiento, el siguiente corte debe avanzar más allá del anterior
+        floor = max(pos, cut)
+        limit = pos + chunk_size
+        if limit >= n:
+            cut = n
+        else:
+            # Último fin de párrafo que cabe en la ventana
+            while pointer + 1 < len(paragraph_cuts) and paragraph_cuts[pointer + 1] <= limit:
+                pointer += 1
+            if pointer >= 0 and paragraph_cuts[pointer] > floor:
+                cut = paragraph_cuts[pointer]
+            else:
+                cut = _last_sentence_end(text, floor, limit)
+                if cut is None:
+                    # Último espacio dentro de la ventana o, si no hay, corte por caracteres
+                    match = _LAST_SPACE_RE.match(text, floor + 1, limit + 1)
+                    cut = match.end() - 1 if match else limit
+
+        next_pos = cut
+        if overlap and cut < n:
+            # El solapamiento empieza al inicio de una palabra
+            next_pos = max(cut - overlap, pos + 1)
+            if not text[next_pos - 1].isspace():
+                space = _NEXT_SPACE_RE.search(text, next_pos, cut)
+                next_pos = space.start() if space else cut
+            next_pos = _SPACE_RE.match(text, next_pos).end()
+            if next_pos >= cut:
+                next_pos = cut
+
+        start, end = _strip_span(text, pos, cut)
+        if start < end:
+            yield start, end, cut, next_pos
+        pos = _SPACE_RE.match(text, next_pos).end()
+
+def chunking_recursive(text, chunk_size=500, overlap=0, as_spans=False):
+    """Divide por párrafos, oraciones, palabras o caracteres sin superar chunk_size caracteres"""
+    return [
+        Chunk(text, start, end) if as_spans else text[start:end]
+        for start, end, _, _ in _recursive_spans(text, chunk_size, overlap)
+    ]
+
+def iter_chunking_recursive(lines, chunk_size=500, overlap=0, as_spans=False):
+    """Versión en streaming de chunking_recursive; da los mismos chunks se parta como se
+    parta el texto de entrada (lo comprueba el subcomando `check`)"""
+    if as_spans:
+        yield from _iter_recursive(lines, chunk_size, overlap)
+        return
+    for _, _, chunk in _iter_recursive(lines, chunk_size, overlap, with_text=True):
+        yield chunk
+
+def _iter_recursive(lines, chunk_size=500, overlap=0, with_text=False):
+    """Offsets (y texto, con with_text) de los chunks recursivos del flujo.
+
+    Acumula texto hasta tener varios chunks y emite los que ya no pueden cambiar
+    con lo que llegue después; el resto se conserva para la siguiente ronda.
+    """
+    buffer = ''
+    base = 0
+    pos = 0  # Inicio del siguiente chunk, relativo al buffer
+    last_cut = 0  # Corte del último chunk emitido, relativo al buffer
+    for piece in lines:
+        buffer += piece
+        safe = len(buffer) - chunk_size - _BOUNDARY_LOOKAHEAD
+        if safe < 3 * chunk_size:
+            continue
+        for start, end, cut, next_pos in _recursive_spans(buffer, chunk_size, overlap, last_cut, pos):
+            if start + chunk_size > safe:
+                break
+            yield (base + start, base + end, buffer[start:end]) if with_text else (base + start, base + end)
+            pos, last_cut = next_pos, cut
+        # Se conservan unos caracteres antes del siguiente chunk: con solapamiento
+        # puede empezar tras "Dr" y el punto siguiente no debe verse como fin de oración
+        drop = max(0, pos - _LOOKBEHIND_CONTEXT)
+        buffer = buffer[drop:]
+        base += drop
+        pos -= drop
+        last_cut = max(0, last_cut - drop)
+    for start, end, _, _ in _recursive_spans(buffer, chunk_size, overlap, last_cut, pos):
+        yield (base + start, base + end, buffer[start:end]) if with_text else (base + start, base + end)
+
+# Métodos disponibles por nombre (versiones en streaming)
+CHUNKING_METHODS = {
+    "words": iter_chunking_text,
+    "sentences": iter_chunking_by_sentences,
+    "paragraphs": iter_chunking_by_paragraphs,
+    "characters": iter_chunking_by_characters,
+    "tokens": iter_chunking_by_tokens,
+    "recursive": iter_chunking_recursive,
+}
+
+# Las mismas versiones en streaming, produciendo (inicio, fin, texto) de cada chunk
+# para quien necesita ambos sin leer el documento dos veces
+_CHUNKING_METHODS_WITH_SPANS = {
+    "words": _iter_text_chunks,
+    "sentences": _iter_sentence_chunks,
+    "paragraphs": lambda lines: _iter_split_spans(lines, _PARAGRAPH_SPLIT_RE, with_text=True),
+    "characters": _iter_character_chunks,
+    "tokens": _iter_token_chunks,
+    "recursive": lambda lines, **params: _iter_recursive(lines, with_text=True, **params),
+}
+
+# --- Rechunking incremental ---
+# Cuando un documento se edita, solo sus párrafos modificados necesitan chunks
+# nuevos. Para que eso sea posible los chunks nunca cruzan un límite de párrafo:
+# cada párrafo se trocea por separado con el método elegido.
+
+def _paragraph_spans(text):
+    return list(iter_chunking_by_paragraphs([text], as_spans=True))
+
+def _chunk_paragraph(text, start, end, method, params):
+    """Chunks de un párrafo con offsets sobre el texto completo"""
+    chunker = CHUNKING_METHODS[method]
+    return [
+        Chunk(text, start + chunk_start, start + chunk_end)
+        for chunk_start, chunk_end in chunker([text[start:end]], as_spans=True, **params)
+    ]
+
+def chunking_by_paragraph_blocks(text, method="words", **params):
+    """Trocea cada párrafo por separado; punto de partida de rechunk_incremental"""
+    chunks = []
+    for start, end in _paragraph_spans(text):
+        chunks.extend(_chunk_paragraph(text, start, end, method, params))
+    return chunks
+
+def rechunk_incremental(old_text, new_text, old_chunks, method="words", **params):
+    """Actualiza los chunks de un documento editado sin volver a trocearlo entero.
+
+    `old_chunks` son los Chunk de old_text producidos por chunking_by_paragraph_blocks
+    (o por una llamada anterior) con el mismo método y parámetros. Los párrafos se
+    comparan por hash de contenido: los que no cambian reutilizan sus chunks con los
+    offsets desplazados y solo los modificados se vuelven a trocear.
+
+    Devuelve (chunks, added, removed): todos los chunks de new_text en orden, los que
+    son nuevos y los de old_chunks que ya no existen. Un chunk que solo cambia de
+    posición (p. ej. un párrafo movido) no aparece en ninguna de las dos listas.
+    """
+    old_spans = _paragraph_spans(old_text)
+    new_spans = _paragraph_spans(new_text)
+    old_keys = [_content_hash(old_text[start:end]) for start, end in old_spans]
+    new_keys = [_content_hash(new_text[start:end]) for start, end in new_spans]
+
+    # Chunks anteriores agrupados por el párrafo que los contiene
+    old_starts = [start for start, _ in old_spans]
+    chunks_by_paragraph = {}
+    for chunk in old_chunks or []:
+        index = bisect.bisect_right(old_starts, chunk.start) - 1
+        chunks_by_paragraph.setdefault(index, []).append(chunk)
+
+    chunks, added, removed = [], [], []
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for old_index, new_index in zip(range(i1, i2), range(j1, j2)):
+                shift = new_spans[new_index][0] - old_spans[old_index][0]
+                chunks.extend(
+                    Chunk(new_text, chunk.start + shift, chunk.end + shift)
+                    for chunk in chunks_by_paragraph.get(old_index, [])
+                )
+            continue
+        for old_index in range(i1, i2):
+            removed.extend(chunks_by_paragraph.get(old_index, []))
+        for new_index in range(j1, j2):
+            fresh = _chunk_paragraph(new_text, *new_spans[new_index], method, params)
+            chunks.extend(fresh)
+            added.extend(fresh)
+
+    # Lo que se eliminó y se volvió a añadir con el mismo contenido se conserva
+    removed_keys = collections.Counter(chunk.digest() for chunk in removed)
+    added_keys = collections.Counter(chunk.digest() for chunk in added)
+    moved = removed_keys & added_keys
+    added = _without_keys(added, moved.copy())
+    removed = _without_keys(removed, moved)
+    return chunks, added, removed
+
+def _without_keys(chunks, keys):
+    """Filtra los chunks cuyo hash aparece en `keys`, consumiendo una aparición por chunk"""
+    kept = []
+    for chunk in chunks:
+        key = chunk.digest()
+        if keys[key] > 0:
+            keys[key] -= 1
+        else:
+            kept.append(chunk)
+    return kept
+
+# --- Eliminación de casi duplicados ---
+# MinHash de una sola permutación sobre shingles de palabras y buckets LSH por bandas:
+# cada chunk se hashea una vez y solo se compara con los chunks de sus mismos buckets
+
+_SHINGLE_SIZE = 3
+_HASH_MASK = (1 << 32) - 1
+
+def _shingle_hashes(text):
+    """Hashes de los n-gramas de palabras (en minúsculas) de un chunk"""
+    words = [zlib.crc32(word.encode("utf-8")) for word in text.lower().split()]
+    if len(words) < _SHINGLE_SIZE:
+        return {hash(tuple(words)) & _HASH_MASK} if words else set()
+    return {
+        (first * 0x9E3779B1 ^ second * 0x85EBCA77 ^ third) & _HASH_MASK
+        for first, second, third in zip(words, words[1:], words[2:])
+    }
+
+def minhash_signature(text, num_perm=64):
+    """Firma MinHash de `num_perm` posiciones calculada con un único hash por shingle"""
+    signature = [None] * num_perm
+    for value in _shingle_hashes(text):
+        # Los bits bajos eligen la posición y el resto compite por el mínimo
+        slot, rest = value % num_perm, value // num_perm
+        if signature[slot] is None or rest < signature[slot]:
+            signature[slot] = rest
+    if all(value is None for value in signature):
+        return None
+    # Densificación: las posiciones vacías copian la siguiente ocupada, desplazada por la distancia
+    for slot in range(num_perm):
+        if signature[slot] is None:
+            distance = 1
+            while signature[(slot + distance) % num_perm] is None:
+                distance += 1
+            signature[slot] = (signature[(slot + distance) % num_perm] + distance * 0x9E3779B1) & _HASH_MASK
+    return tuple(signature)
+
+def _similarity(first, second):
+    """Similitud de Jaccard estimada a partir de dos firmas"""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+def iter_dedup_chunks(chunks, threshold=0.9, num_perm=64, bands=16, key=str, stats=None):
+    """Descarta los chunks casi duplicados de uno anterior conservando el primero.
+
+    Acepta texto o Chunk (o cualquier objeto si `key` devuelve su texto) y cuenta los
+    descartados en `stats["dropped"]`.
+    """
+    if num_perm % bands:
+        raise ValueError("num_perm debe ser múltiplo de bands")
+    rows = num_perm // bands
+    buckets = collections.defaultdict(list)
+    if stats is not None:
+        stats.setdefault("dropped", 0)
+    for chunk in chunks:
+        signature = minhash_signature(key(chunk), num_perm)
+        if signature is None:
+            yield chunk
+            continue
+        band_keys = [(band, signature[band * rows:(band + 1) * rows]) for band in range(bands)]
+        seen = set()
+        duplicate = False
+        for band_key in band_keys:
+            for candidate in buckets.get(band_key, ()):
+                if id(candidate) not in seen:
+                    seen.add(id(candidate))
+                    if _similarity(signature, candidate) >= threshold:
+                        duplicate = True
+                        break
+            if duplicate:
+                break
+        if duplicate:
+            if stats is not None:
+                stats["dropped"] += 1
+            continue
+        # Solo se indexan los chunks conservados: los descartados no amplían los buckets
+        for band_key in band_keys:
+            buckets[band_key].append(signature)
+        yield chunk
+
+def dedup_chunks(chunks, threshold=0.9, num_perm=64, bands=16, key=str):
+    """Versión en lista de iter_dedup_chunks: devuelve (chunks conservados, número de descartados)"""
+    stats = {}
+    kept = list(iter_dedup_chunks(chunks, threshold, num_perm, bands, key, stats))
+    return kept, stats["dropped"]
+
+# --- Ingesta por lotes (sin interfaz) ---
+# Uso: python 2-text-chunking.py ingest DIR --method sentences --output chunks.jsonl
+
+# Parámetros de cada método que controlan --chunk-size y --overlap
+_SIZE_PARAMS = {
+    "words": ("chunk_size", "overlap"),
+    "sentences": ("max_sentences", "overlap_sentences"),
+    "paragraphs": (None, None),
+    "characters": ("chunk_size", "overlap"),
+    "tokens": ("max_tokens", None),
+    "recursive": ("chunk_size", "overlap"),
+}
+
+_COLUMNS = [("doc_id", "I", "<u4"), ("start", "q", "<i8"), ("end", "q", "<i8")]
+
+def _method_params(args):
+    size_param, overlap_param = _SIZE_PARAMS[args.method]
+    params = {}
+    if size_param and args.chunk_size is not None:
+        params[size_param] = args.chunk_size
+    if overlap_param and args.overlap is not None:
+        params[overlap_param] = args.overlap
+    if args.method == "tokens":
+        params["unit"] = args.unit
+    return params
+
+def _find_documents(directory, extensions):
+    """Rutas de los documentos del directorio en orden estable"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                paths.append(os.path.join(root, name))
+    return paths
+
+def _open_document(path):
+    return open(path, encoding="utf-8", errors="replace", newline="")
+
+def _ingest_document(task):
+    """Trocea un documento en un proceso del pool.
+
+    Para JSONL escribe sus líneas en un archivo parcial y devuelve su ruta; para el
+    formato columnar devuelve directamente los offsets empaquetados.
+    """
+    doc_id, path, rel_path, method, params, output_format, part_path, dedup = task
+    size = os.path.getsize(path)
+    stats = {"dropped": 0}
+
+    if output_format == "columnar":
+        starts, ends = array("q"), array("q")
+        with _open_document(path) as document:
+            if dedup is None:
+                spans = CHUNKING_METHODS[method](document, as_spans=True, **params)
+            else:
+                # El texto solo hace falta para calcular las firmas MinHash
+                chunks = _CHUNKING_METHODS_WITH_SPANS[method](document, **params)
+                chunks = iter_dedup_chunks(chunks, dedup, key=lambda chunk: chunk[2], stats=stats)
+                spans = ((start, end) for start, end, _ in chunks)
+            for start, end in spans:
+                starts.append(start)
+                ends.append(end)
+        return doc_id, len(starts), size, stats["dropped"], starts.tobytes(), ends.tobytes()
+
+    count = 0
+    with _open_document(path) as document, open(part_path, "w", encoding="utf-8") as part:
+        chunks = _CHUNKING_METHODS_WITH_SPANS[method](document, **params)
+        if dedup is not None:
+            chunks = iter_dedup_chunks(chunks, dedup, key=lambda chunk: chunk[2], stats=stats)
+        for count, (start, end, text) in enumerate(chunks, 1):
+            record = {"doc_id": doc_id, "path": rel_path, "chunk": count - 1, "start": start, "end": end, "text": text}
+            part.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return doc_id, count, size, stats["dropped"], part_path, None
+
+def ingest(directory, output, method="sentences", params=None, output_format="jsonl",
+           workers=None, extensions=(".txt", ".md"), dedup=None):
+    """Trocea todos los documentos de `directory` en paralelo y escribe los chunks en `output`.
+
+    Cada documento se procesa en streaming dentro de un proceso del pool, así que
+    la memoria por proceso no depende del tamaño del documento. Con `dedup` (umbral
+    de similitud) se descartan los chunks casi duplicados dentro de cada documento.
+    """
+    params = params or {}
+    paths = _find_documents(directory, tuple(extensions))
+    parts_dir = output + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    tasks = [
+        (doc_id, path, os.path.relpath(path, directory), method, params, output_format,
+         os.path.join(parts_dir, f"{doc_id:08d}.jsonl"), dedup)
+        for doc_id, path in enumerate(paths)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    # Varios documentos por envío reducen el coste de comunicación con archivos pequeños
+    batch = max(1, len(tasks) // (workers * 4))
+    stats = {"documents": len(paths), "chunks": 0, "bytes": 0, "dropped": 0}
+    columns = {name: open(os.path.join(parts_dir, name), "wb") for name, _, _ in _COLUMNS}
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(output, "wb") as out:
+            # map conserva el orden de los documentos aunque terminen desordenados
+            for doc_id, count, size, dropped, first, second in pool.map(_ingest_document, tasks, chunksize=batch):
+                stats["chunks"] += count
+                stats["bytes"] += size
+                stats["dropped"] += dropped
+                if output_format == "columnar":
+                    doc_ids = array("I", [doc_id]) * count
+                    starts, ends = array("q"), array("q")
+                    starts.frombytes(first)
+                    ends.frombytes(second)
+                    for (name, _, _), column in zip(_COLUMNS, (doc_ids, starts, ends)):
+                        if sys.byteorder == "big":
+                            column.byteswap()
+                        column.tofile(columns[name])
+                else:
+                    with open(first, "rb") as part:
+                        shutil.copyfileobj(part, out)
+                    os.remove(first)
+
+            if output_format == "columnar":
+                # Cabecera JSON en la primera línea y después cada columna contigua
+                header = {
+                    "format": "chunks-columnar",
+                    "version": 1,
+                    "method": method,
+                    "params": params,
+                    "dedup": dedup,
+                    "rows": stats["chunks"],
+                    "columns": [{"name": name, "dtype": dtype} for name, _, dtype in _COLUMNS],
+                    "documents": [task[2] for task in tasks],
+                }
+                out.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+                for name, column in columns.items():
+                    column.close()
+                    with open(column.name, "rb") as data:
+                        shutil.copyfileobj(data, out)
+    finally:
+        for column in columns.values():
+            column.close()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    return stats
+
+def read_columnar(path):
+    """Lee un archivo columnar de ingest: devuelve (cabecera, {columna: array})"""
+    with open(path, "rb") as data:
+        header = json.loads(data.readline())
+        columns = {}
+        for name, typecode, _ in _COLUMNS:
+            column = array(typecode)
+            column.fromfile(data, header["rows"])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns[name] = column
+    return header, columns
+
+# --- Benchmark de las estrategias de chunking ---
+# Corpus sintético reproducible (semilla fija) y resultados en JSON comparables entre commits
+
+_BENCH_VOCABULARY = {
+    "es": (
+        "el la los las un una de del en con por para que como pero sistema modelo texto "
+        "documento datos consulta respuesta búsqueda índice vector red análisis proceso "
+        "información resultado método estudio año país ciudad empresa gobierno tiempo "
+        "desarrollo trabajo mercado grupo parte forma caso punto lugar problema servicio"
+    ).split(),
+    "en": (
+        "the a of to and in for with on by that as but system model text document data "
+        "query answer search index vector network analysis process information result "
+        "method study year country city company government time development work market "
+        "group part way case point place problem service"
+    ).split(),
+}
+_BENCH_EXTRAS = {
+    "es": ["Sr.", "Dra.", "pág.", "etc.", "EE.UU.", "3.14", "12.5%", "J. R."],
+    "en": ["Mr.", "Dr.", "e.g.", "etc.", "U.S.", "3.14", "12.5%", "J. R."],
+}
+_BENCH_TERMINATORS = [".", ".", ".", ".", "?", "!", "..."]
+
+# (método, parámetros) de cada configuración medida: sin y con solapamiento
+_BENCH_CONFIGS = [
+    ("words", {"chunk_size": 200, "overlap": 0}),
+    ("words", {"chunk_size": 200, "overlap": 50}),
+    ("sentences", {"max_sentences": 5, "overlap_sentences": 0}),
+    ("sentences", {"max_sentences": 5, "overlap_sentences": 1}),
+    ("paragraphs", {}),
+    ("characters", {"chunk_size": 500, "overlap": 0}),
+    ("characters", {"chunk_size": 500, "overlap": 100}),
+    ("tokens", {"max_tokens": 512, "unit": "sentences"}),
+    ("recursive", {"chunk_size": 500, "overlap": 0}),
+    ("recursive", {"chunk_size": 500, "overlap": 100}),
+]
+
+# Configuraciones que se miden además sobre un corpus sin fronteras (un único
+# párrafo sin signos terminales, en líneas de ~80 caracteres): detectan costes
+# cuadráticos al acumular texto pendiente en las variantes streaming
+_BENCH_UNBROKEN_CONFIGS = [
+    ("words", {"chunk_size": 200, "overlap": 50}),
+    ("sentences", {"max_sentences": 5, "overlap_sentences": 1}),
+    ("paragraphs", {}),
+    ("tokens", {"max_tokens": 512, "unit": "sentences"}),
+    ("tokens", {"max_tokens": 512, "unit": "paragraphs"}),
+]
+
+_BENCH_VARIANTS = ("list", "list-spans", "stream", "stream-spans")
+
+# Chunks que se retienen al contar bloques asignados por chunk en las variantes streaming
+_BENCH_ALLOC_SAMPLE = 10000
+
+def _list_chunkers():
+    return {
+        "words": chunking_text,
+        "sentences": chunking_by_sentences,
+        "paragraphs": chunking_by_paragraphs,
+        "characters": chunking_by_characters,
+        "tokens": chunking_by_tokens,
+        "recursive": chunking_recursive,
+    }
+
+def _synthetic_paragraph(rng, language):
+    """Párrafo de 1 a 6 oraciones con abreviaturas, decimales e iniciales"""
+    words, extras = _BENCH_VOCABULARY[language], _BENCH_EXTRAS[language]
+    sentences = []
+    for _ in range(rng.randint(1, 6)):
+        sentence = rng.choices(words, k=rng.randint(4, 30))
+        if rng.random() < 0.3:
+            sentence.insert(rng.randrange(len(sentence)), rng.choice(extras))
+        sentence = " ".join(sentence)
+        sentences.append(sentence[0].upper() + sentence[1:] + rng.choice(_BENCH_TERMINATORS))
+    return " ".join(sentences)
+
+def _unbroken_lines(rng):
+    """256 líneas de ~80 caracteres sin signos terminales ni líneas en blanco"""
+    lines = []
+    for _ in range(256):
+        words = _BENCH_VOCABULARY["es" if rng.random() < 0.5 else "en"]
+        line = []
+        while sum(len(word) + 1 for word in line) < 80:
+            line.append(rng.choice(words))
+        lines.append(" ".join(line))
+    return "\n".join(lines) + "\n"
+
+def generate_corpus(path, size_mb, seed=0, boundaries=True):
+    """Escribe en `path` un corpus español/inglés determinista de `size_mb` MB.
+
+    Con boundaries=False el corpus es un único párrafo sin signos terminales.
+    """
+    import random
+
+    rng = random.Random(seed)
+    target = int(size_mb * 1e6)
+    written = 0
+    with open(path, "w", encoding="utf-8") as corpus:
+        while written < target:
+            if not boundaries:
+                block = _unbroken_lines(rng)
+            else:
+                block = "\n\n".join(
+                    _synthetic_paragraph(rng, "es" if rng.random() < 0.5 else "en") for _ in range(256)
+                ) + "\n\n"
+            written += len(block.encode("utf-8"))
+            corpus.write(block)
+    return path
+
+def _bench_corpus(corpus_dir, size_mb, seed, corpus="prose"):
+    """Reutiliza el corpus ya generado para el mismo tipo, tamaño y semilla"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    prefix = "corpus" if corpus == "prose" else f"corpus-{corpus}"
+    path = os.path.join(corpus_dir, f"{prefix}-{size_mb:g}mb-seed{seed}.txt")
+    if not os.path.exists(path):
+        generate_corpus(path + ".tmp", size_mb, seed, boundaries=corpus == "prose")
+        os.replace(path + ".tmp", path)
+    return path
+
+def _bench_run(path, method, params, variant, text=None):
+    """Devuelve un iterable con los chunks de la variante indicada"""
+    as_spans = variant.endswith("spans")
+    if variant.startswith("list"):
+        return _list_chunkers()[method](text, as_spans=as_spans, **params)
+    return CHUNKING_METHODS[method](_open_document(path), as_spans=as_spans, **params)
+
+def _consume(chunks):
+    count = 0
+    for count, _ in enumerate(chunks, 1):
+        pass
+    return count
+
+def _bench_case(path, size_bytes, method, params, variant, text, trace):
+    """Mide una combinación: pasada de tiempo y, por separado, pasada de memoria"""
+    import gc
+    import tracemalloc
+    from itertools import islice
+
+    gc.collect()
+    start = time.perf_counter()
+    chunks = _consume(_bench_run(path, method, params, variant, text))
+    elapsed = time.perf_counter() - start
+    result = {
+        "method": method,
+        "params": params,
+        "variant": variant,
+        "bytes": size_bytes,
+        "chunks": chunks,
+        "seconds": round(elapsed, 4),
+        "mb_per_s": round(size_bytes / 1e6 / elapsed, 3) if elapsed else None,
+        "chunks_per_s": round(chunks / elapsed, 1) if elapsed else None,
+    }
+    if not trace:
+        return result
+
+    # tracemalloc ralentiza la ejecución, por eso no comparte pasada con el cronómetro
+    gc.collect()
+    tracemalloc.start()
+    _consume(_bench_run(path, method, params, variant, text))
+    result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 3)
+    tracemalloc.stop()
+
+    # Bloques vivos por chunk mientras se retienen los resultados
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    output = _bench_run(path, method, params, variant, text)
+    retained = output if variant.startswith("list") else list(islice(output, _BENCH_ALLOC_SAMPLE))
+    result["blocks_per_chunk"] = round((sys.getallocatedblocks() - blocks) / max(len(retained), 1), 2)
+    del output, retained
+    return result
+
+def _git_commit():
+    import subprocess
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _bench_key(result):
+    return (result.get("corpus", "prose"), result["method"], json.dumps(result["params"], sort_keys=True),
+            result["variant"], result["bytes"])
+
+def run_benchmark(sizes=(1, 10, 100, 1000), methods=None, variants=_BENCH_VARIANTS, corpus_dir=None,
+                  seed=0, max_in_memory_mb=100, trace=True, log=None):
+    """Ejecuta el benchmark y devuelve un diccionario serializable a JSON.
+
+    Las variantes en lista cargan el corpus entero en memoria, así que solo se miden
+    hasta `max_in_memory_mb`; las variantes en streaming se miden en todos los tamaños.
+    El corpus sin fronteras también se limita a `max_in_memory_mb`, porque su único
+    párrafo se retiene entero en cualquier variante que agrupe por párrafos u oraciones.
+    """
+    import platform
+    import tempfile
+
+    corpus_dir = corpus_dir or os.path.join(tempfile.gettempdir(), "chunking-bench")
+    corpora = [
+        ("prose", [(method, params) for method, params in _BENCH_CONFIGS if not methods or method in methods]),
+        ("unbroken", [(method, params) for method, params in _BENCH_UNBROKEN_CONFIGS if not methods or method in methods]),
+    ]
+    results = []
+    for size_mb in sizes:
+        for corpus, configs in corpora:
+            if not configs or (corpus == "unbroken" and size_mb > max_in_memory_mb):
+                continue
+            path = _bench_corpus(corpus_dir, size_mb, seed, corpus)
+            size_bytes = os.path.getsize(path)
+            text = None
+            if size_mb <= max_in_memory_mb and any(variant.startswith("list") for variant in variants):
+                with _open_document(path) as document:
+                    text = document.read()
+            for method, params in configs:
+                for variant in variants:
+                    if variant.startswith("list") and text is None:
+                        continue
+                    result = _bench_case(path, size_bytes, method, params, variant, text, trace)
+                    result["corpus"] = corpus
+                    result["size_mb"] = size_mb
+                    results.append(result)
+                    if log:
+                        log(result)
+            del text
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seed": seed,
+            "tiktoken": tiktoken is not None,
+        },
+        "results": results,
+    }
+
+def compare_benchmarks(baseline, current, threshold=0.1):
+    """Compara dos resultados de run_benchmark: devuelve las filas comunes y las regresiones"""
+    previous = {_bench_key(result): result for result in baseline["results"]}
+    rows, regressions = [], []
+    for result in current["results"]:
+        before = previous.get(_bench_key(result))
+        if not before or not before.get("mb_per_s") or not result.get("mb_per_s"):
+            continue
+        row = {
+            "corpus": result.get("corpus", "prose"),
+            "method": result["method"],
+            "params": result["params"],
+            "variant": result["variant"],
+            "size_mb": result.get("size_mb"),
+            "speedup": round(result["mb_per_s"] / before["mb_per_s"], 3),
+        }
+        if before.get("peak_traced_mb") and "peak_traced_mb" in result:
+            row["memory_ratio"] = round(result["peak_traced_mb"] / before["peak_traced_mb"], 3)
+        rows.append(row)
+        if row["speedup"] < 1 - threshold or row.get("memory_ratio", 1) > 1 + threshold:
+            regressions.append(row)
+    return rows, regressions
+
+def _format_params(params):
+    return ",".join(f"{key}={value}" for key, value in params.items())
+
+def _format_bench_result(result):
+    params = _format_params(result["params"])
+    line = (f"{result['size_mb']:>6g} MB  {result.get('corpus', 'prose'):<8} {result['method']:<10} {params:<36} {result['variant']:<12} "
+            f"{result['mb_per_s']:>8} MB/s {result['chunks_per_s']:>11} chunks/s")
+    if "peak_traced_mb" in result:
+        line += f"  pico {result['peak_traced_mb']} MB  {result['blocks_per_chunk']} bloques/chunk"
+    return line
+
+# --- Comprobación de las variantes en streaming ---
+# Las variantes iter_* deben producir los mismos chunks que las de lista aunque el
+# texto llegue partido en fragmentos arbitrarios. Los textos aleatorios mezclan
+# abreviaturas, decimales y párrafos, y los chunks pequeños con mucho solapamiento
+# son los que más ejercitan el estado que se arrastra entre fragmentos.
+
+_CHECK_WORDS = "a bb ccc dddd Sr. Dr. etc. fin. 3.5 ¿qué? ¡no! eee.\n\n ff\n gg... hh".split(" ")
+
+def _check_configs(rng):
+    """Un juego de parámetros al azar para cada método, con solapamientos de hasta el tamaño"""
+    words, sentences, chars, recursive = (rng.randint(1, 12), rng.randint(1, 6),
+                                          rng.randint(1, 60), rng.randint(2, 40))
+    return [
+        ("words", {"chunk_size": words, "overlap": rng.randint(0, words)}),
+        ("sentences", {"max_sentences": sentences, "overlap_sentences": rng.randint(0, sentences)}),
+        ("paragraphs", {}),
+        ("characters", {"chunk_size": chars, "overlap": rng.randint(0, chars)}),
+        ("tokens", {"max_tokens": rng.randint(1, 30), "unit": "sentences"}),
+        ("tokens", {"max_tokens": rng.randint(1, 60), "unit": "paragraphs"}),
+        ("recursive", {"chunk_size": recursive, "overlap": rng.randint(0, recursive)}),
+    ]
+
+def check_streaming(cases=2000, seed=0):
+    """Compara las variantes en streaming con las de lista sobre `cases` textos aleatorios
+    partidos en fragmentos al azar; devuelve los casos que no coinciden"""
+    import random
+
+    rng = random.Random(seed)
+    list_chunkers = _list_chunkers()
+    mismatches = []
+    for case in range(cases):
+        text = " ".join(rng.choice(_CHECK_WORDS) for _ in range(rng.randint(0, 600)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 400))))
+        pieces = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+        for method, params in _check_configs(rng):
+            expected = [(chunk.start, chunk.end) for chunk in list_chunkers[method](text, as_spans=True, **params)]
+            if (list(CHUNKING_METHODS[method](iter(pieces), as_spans=True, **params)) != expected
+                    or list(CHUNKING_METHODS[method](iter(pieces), **params)) != list_chunkers[method](text, **params)):
+                mismatches.append({"case": case, "method": method, "params": params, "text": text})
+    return mismatches
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Herramientas de chunking sin interfaz")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="Trocea en paralelo todos los documentos de un directorio")
+    ingest_parser.add_argument("directory")
+    ingest_parser.add_argument("--method", choices=sorted(CHUNKING_METHODS), default="sentences")
+    ingest_parser.add_argument("--chunk-size", type=int, help="Palabras, oraciones, caracteres o tokens por chunk según el método")
+    ingest_parser.add_argument("--overlap", type=int, help="Solapamiento en las unidades del método")
+    ingest_parser.add_argument("--unit", choices=["sentences", "paragraphs"], default="sentences", help="Unidad a empaquetar con --method tokens")
+    ingest_parser.add_argument("--format", choices=["jsonl", "columnar"], default="jsonl")
+    ingest_parser.add_argument("--output", "-o", default="chunks.jsonl")
+    ingest_parser.add_argument("--workers", type=int, default=None, help="Procesos del pool (por defecto, uno por núcleo)")
+    ingest_parser.add_argument("--ext", nargs="+", default=[".txt", ".md"], help="Extensiones de archivo a procesar")
+    ingest_parser.add_argument("--dedup", type=float, nargs="?", const=0.9, metavar="UMBRAL",
+                               help="Descarta chunks casi duplicados (similitud de Jaccard estimada, 0.9 por defecto)")
+
+    bench_parser = commands.add_parser("bench", help="Mide velocidad y memoria de cada estrategia sobre corpus sintéticos")
+    bench_parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 100, 1000], help="Tamaños del corpus en MB")
+    bench_parser.add_argument("--methods", nargs="+", choices=sorted(CHUNKING_METHODS))
+    bench_parser.add_argument("--variants", nargs="+", choices=_BENCH_VARIANTS, default=list(_BENCH_VARIANTS))
+    bench_parser.add_argument("--max-in-memory", type=float, default=100, help="Tamaño máximo (MB) para las variantes en lista")
+    bench_parser.add_argument("--corpus-dir", help="Directorio donde se guardan los corpus generados")
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--no-trace", action="store_true", help="Omite la pasada de memoria con tracemalloc")
+    bench_parser.add_argument("--output", "-o", default="bench-chunking.json")
+    bench_parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    bench_parser.add_argument("--threshold", type=float, default=0.1, help="Pérdida relativa a partir de la que se marca una regresión")
+
+    check_parser = commands.add_parser("check", help="Comprueba que las variantes en streaming coinciden con las de lista")
+    check_parser.add_argument("--cases", type=int, default=2000, help="Textos aleatorios a comprobar")
+    check_parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        start = time.perf_counter()
+        stats = ingest(args.directory, args.output, args.method, _method_params(args),
+                       args.format, args.workers, args.ext, args.dedup)
+        elapsed = time.perf_counter() - start
+        megabytes = stats["bytes"] / 1e6
+        print(
+            f"{stats['documents']} documentos, {stats['chunks']} chunks ({stats['dropped']} duplicados descartados), {megabytes:.1f} MB "
+            f"en {elapsed:.2f}s ({megabytes / elapsed if elapsed else 0:.1f} MB/s) -> {args.output}",
+            file=sys.stderr,
+        )
+    elif args.command == "bench":
+        report = run_benchmark(
+            [int(size) if size.is_integer() else size for size in args.sizes], args.methods, args.variants,
+            args.corpus_dir, args.seed, args.max_in_memory, not args.no_trace,
+            log=lambda result: print(_format_bench_result(result), file=sys.stderr),
+        )
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, ensure_ascii=False, indent=2)
+        print(f"{len(report['results'])} mediciones -> {args.output}", file=sys.stderr)
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as baseline_file:
+                rows, regressions = compare_benchmarks(json.load(baseline_file), report, args.threshold)
+            for row in rows:
+                flag = "  REGRESIÓN" if row in regressions else ""
+                print(f"{row['corpus']:<8} {row['method']:<10} {_format_params(row['params']):<36} {row['variant']:<12} {row['size_mb']:>6g} MB  "
+                      f"x{row['speedup']} velocidad  x{row.get('memory_ratio', '-')} memoria{flag}", file=sys.stderr)
+            if regressions:
+                sys.exit(1)
+    elif args.command == "check":
+        mismatches = check_streaming(args.cases, args.seed)
+        for mismatch in mismatches[:10]:
+            print(f"caso {mismatch['case']}: {mismatch['method']} {mismatch['params']} {mismatch['text'][:80]!r}", file=sys.stderr)
+        print(f"{len(mismatches)} discrepancias en {args.cases} textos", file=sys.stderr)
+        if mismatches:
+            sys.exit(1)
+
 if __name__ == "__main__":
-    main()
+    # `streamlit run` ejecuta el script sin argumentos: en ese caso se abre la interfaz
+    if len(sys.argv) > 1:
+        cli()
+    else:
+        main()
@@ -1,17 +1,42 @@
 # File: RA1/IL1.4/1-evaluation-rag.py
 import streamlit as st
 import os
+import asyncio
+import atexit
+import collections
+import contextlib
+import functools
+import hashlib
+import inspect
 import json
+import argparse
+import random
+import re
+import sqlite3
+import sys
+import threading
 import time
 import uuid
 from datetime import datetime
 import pandas as pd
 import numpy as np
-from openai import OpenAI
-from sklearn.metrics.pairwise import cosine_similarity
+import openai
+from openai import AsyncOpenAI, OpenAI
 import plotly.express as px
 import plotly.graph_objects as go
 
+# faiss es opcional: sin él se usa el índice IVF implementado con NumPy
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# fcntl solo existe en POSIX: sin él la caché de embeddings no se bloquea entre procesos
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # LangChain imports
 from langchain_openai import OpenAIEmbeddings
 from langchain.schema import Document
@@ -31,12 +56,6 @@ github_base_url = os.getenv("GITHUB_BASE_URL", "https://models.inference.ai.azur
 if github_token:
     os.environ["OPENAI_API_KEY"] = github_token
     os.environ["OPENAI_API_BASE"] = github_base_url
-else:
-    st.error("❌ GITHUB_TOKEN environment variable is not set. Please check your .env file.")
-    st.info("💡 Make sure your .env file contains: GITHUB_TOKEN=your_token_here")
-    st.stop()
-
-st.set_page_config(page_title="RAG Evaluation", page_icon="📊", layout="wide")
 
 def initialize_client():
     if not github_token:
@@ -65,36 +84,1005 @@ def initialize_embeddings():
         st.error(f"Error initializing embeddings: {str(e)}")
         return None
 
+# --- Instrumentación de latencias ---
+class LatencyHistogram:
+    """Fixed-precision histogram of nanosecond latencies in the style of HdrHistogram.
+
+    Values below 2**(SUB_BUCKET_BITS + 1) ns get their own bucket; above that every power
+    of two is split into 2**SUB_BUCKET_BITS buckets, so percentiles carry a relative error
+    under 1% and memory depends on the range of values, not on how many are recorded.
+    """
+
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @classmethod
+    def bucket(cls, value):
+        shift = max(0, value.bit_length() - cls.SUB_BUCKET_BITS - 1)
+        return (shift << cls.SUB_BUCKET_BITS) + (value >> shift)
+
+    @classmethod
+    def bucket_range(cls, index):
+        """(lowest value, width) of a bucket"""
+        if index < 2 << cls.SUB_BUCKET_BITS:
+            return index, 1
+        shift = (index >> cls.SUB_BUCKET_BITS) - 1
+        return (index - (shift << cls.SUB_BUCKET_BITS)) << shift, 1 << shift
+
+    def record(self, value):
+        value = max(0, int(value))
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = max(1, int(np.ceil(q / 100 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, width = self.bucket_range(index)
+                return min(max(low + width // 2, self.min), self.max)
+        return self.max
+
+    def summary(self, buckets=False):
+        """Count, mean and p50/p95/p99/max in milliseconds; with `buckets`, also the raw
+        [lowest value in ns, count] pairs so exported histograms can be merged"""
+        data = {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6 if self.count else 0.0,
+            'p50_ms': self.percentile(50) / 1e6,
+            'p95_ms': self.percentile(95) / 1e6,
+            'p99_ms': self.percentile(99) / 1e6,
+            'max_ms': self.max / 1e6,
+        }
+        if buckets:
+            data['buckets'] = [[self.bucket_range(index)[0], self.counts[index]] for index in sorted(self.counts)]
+        return data
+
+class _Span:
+    __slots__ = ("recorder", "name", "start")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+class LatencyRecorder:
+    """Named latency histograms fed by `with recorder.span(name): ...` blocks timed with perf_counter_ns"""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def record(self, name, nanoseconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(nanoseconds)
+
+    def snapshot(self, buckets=False):
+        with self._lock:
+            return {name: histogram.summary(buckets) for name, histogram in sorted(self.histograms.items())}
+
+    def to_json(self):
+        return json.dumps({'generated': datetime.now().isoformat(), 'spans': self.snapshot(buckets=True)}, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+@st.cache_resource
+def get_latency_recorder():
+    """Process-wide recorder shared by every session (and the headless runner)"""
+    return LatencyRecorder()
+
+# Se resuelve una vez por ejecución del script: cada reejecución obtiene el mismo objeto
+# de la caché y los spans no pagan la búsqueda en st.cache_resource
+latency_recorder = get_latency_recorder()
+
+def timed(name):
+    """Decorator that records every call of a function or coroutine function under `name`"""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with latency_recorder.span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with latency_recorder.span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Caché persistente de embeddings ---
+# Direccionada por contenido: SHA-256 de (modelo, texto) -> fila de una matriz float32 en disco
+EMBEDDING_CACHE_DIR = os.getenv(
+    "RAG_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".rag_cache")
+)
+
+class EmbeddingCache:
+    """On-disk embedding cache for one model.
+
+    Vectors are appended to a raw float32 file that is read through `np.memmap`, and
+    the SHA-256 key of each row is appended to a companion index file in the same
+    order, so loading the cache only reads the keys. Appends hold an exclusive lock
+    on `lock` and first pick up the rows other processes appended, so several
+    processes can share the same directory.
+    """
+
+    KEY_SIZE = 32
+
+    def __init__(self, model, cache_dir=None):
+        self.model = model
+        safe_model = "".join(c if c.isalnum() or c in "-_." else "_" for c in model)
+        self.directory = os.path.join(cache_dir or EMBEDDING_CACHE_DIR, safe_model)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "lock")
+        self.dim = None
+        self.rows = {}
+        self._count = 0  # Filas completas en disco (puede haber claves repetidas)
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path) as f:
+            self.dim = json.load(f)["dim"]
+        self._sync()
+
+    def _sync(self):
+        """Read the keys appended since the last sync, possibly by another process"""
+        try:
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._count * self.KEY_SIZE)
+                keys = f.read()
+            vector_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        except FileNotFoundError:
+            return
+        # Si una escritura se interrumpió, solo valen las filas presentes en ambos archivos
+        count = min(self._count + len(keys) // self.KEY_SIZE, vector_rows)
+        for row in range(self._count, count):
+            offset = (row - self._count) * self.KEY_SIZE
+            self.rows.setdefault(keys[offset:offset + self.KEY_SIZE], row)
+        self._count = max(self._count, count)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # Cerrar el archivo libera el bloqueo
+            yield
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).digest()
+
+    def _vectors(self):
+        if self._matrix is None or len(self._matrix) < self._count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self._count, self.dim))
+        return self._matrix
+
+    def lookup(self, texts):
+        """Return (vectors, missing): a float32 matrix with the cached rows filled in
+        (None if nothing is cached) and the positions of the texts that are not cached."""
+        with self._lock:
+            rows = [self.rows.get(self.key(text)) for text in texts]
+            missing = [i for i, row in enumerate(rows) if row is None]
+            if self.dim is None:
+                return None, missing
+            vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+            found = [i for i, row in enumerate(rows) if row is not None]
+            if found:
+                vectors[found] = self._vectors()[[rows[i] for i in found]]
+            return vectors, missing
+
+    def add(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            if self.dim is None:
+                # Otro proceso puede haber creado la caché desde que se abrió esta
+                self._load()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, "w") as f:
+                    json.dump({"model": self.model, "dim": self.dim}, f)
+            self._sync()
+            # Clave -> índice del vector en `vectors`, en orden de aparición
+            new = {}
+            for i, text in enumerate(texts):
+                key = self.key(text)
+                if key not in self.rows and key not in new:
+                    new[key] = i
+            if not new:
+                return
+            new_keys = list(new)
+            # Se descartan los restos de escrituras interrumpidas para que la fila i
+            # de ambos archivos vuelva a coincidir antes de añadir las nuevas
+            for path, size in ((self.vectors_path, self._count * 4 * self.dim),
+                               (self.keys_path, self._count * self.KEY_SIZE)):
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    os.truncate(path, size)
+            # Primero los vectores y después las claves: una clave nunca apunta a una fila incompleta
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[list(new.values())], dtype="<f4").tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            for row, key in enumerate(new_keys, self._count):
+                self.rows[key] = row
+            self._count += len(new_keys)
+
+@st.cache_resource
+def get_embedding_cache(model):
+    """Shared cache instance per model for every session of the app"""
+    return EmbeddingCache(model)
+
+def _embeddings_model_name(embeddings_model):
+    return getattr(embeddings_model, "model", None) or type(embeddings_model).__name__
+
+def load_cached_embeddings(embeddings_model, texts):
+    """Embedding matrix built only from the disk cache, or None if any text is missing"""
+    if embeddings_model is None or not texts:
+        return None
+    vectors, missing = get_embedding_cache(_embeddings_model_name(embeddings_model)).lookup(texts)
+    return None if missing else EmbeddingMatrix.from_array(vectors)
+
+# --- Embeddings por lotes concurrentes ---
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("RAG_EMBEDDING_BATCH_TOKENS", "64000"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("RAG_EMBEDDING_CONCURRENCY", "4"))
+
+def _estimate_tokens(text):
+    # Aproximación de ~4 caracteres por token, suficiente para acotar el tamaño de los lotes
+    return len(text) // 4 + 1
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retrying: the server's Retry-After if given, else exponential backoff with jitter"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(60.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+async def embed_texts_async(texts, model="text-embedding-3-small", client=None,
+                            max_batch_tokens=None, max_batch_size=None, concurrency=None, max_retries=6,
+                            dimensions=None, fallback=None):
+    """Embed `texts` in token-bounded batches with up to `concurrency` requests in flight.
+
+    A 429 halves the batch size used from then on (splitting the failing batch) and
+    every successful request grows it by one, so throughput settles near the rate
+    limit. A batch rejected with a 400 is embedded with `fallback(texts)` when given
+    (e.g. LangChain's embed_documents, which splits over-long texts). Results keep
+    the order of `texts`. A client created here is closed before returning.
+    """
+    if client is None:
+        # Los reintentos los gestiona este pipeline, no el cliente
+        async with AsyncOpenAI(base_url=github_base_url, api_key=github_token, max_retries=0) as client:
+            return await embed_texts_async(texts, model, client, max_batch_tokens, max_batch_size,
+                                           concurrency, max_retries, dimensions, fallback)
+    max_batch_tokens = max_batch_tokens or EMBEDDING_MAX_BATCH_TOKENS
+    max_batch_size = max_batch_size or EMBEDDING_MAX_BATCH_SIZE
+    concurrency = concurrency or EMBEDDING_CONCURRENCY
+    options = {"dimensions": dimensions} if dimensions else {}
+    vectors = [None] * len(texts)
+    pending = collections.deque()
+    plan = {"cursor": 0, "limit": max_batch_size}
+
+    def next_batch():
+        if pending:
+            return pending.popleft()
+        start = end = plan["cursor"]
+        tokens = 0
+        while end < len(texts) and end - start < plan["limit"]:
+            tokens += _estimate_tokens(texts[end])
+            if end > start and tokens > max_batch_tokens:
+                break
+            end += 1
+        plan["cursor"] = end
+        return (start, end) if end > start else None
+
+    async def worker():
+        while (batch := next_batch()) is not None:
+            start, end = batch
+            for attempt in range(max_retries + 1):
+                try:
+                    response = await client.embeddings.create(model=model, input=texts[start:end], **options)
+                    break
+                except openai.BadRequestError:
+                    if fallback is None:
+                        raise
+                    response = None
+                    break
+                except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                    if attempt == max_retries:
+                        raise
+                    if isinstance(e, openai.RateLimitError):
+                        # Varios lotes en vuelo pueden fallar a la vez: se reduce respecto al lote, sin acumular
+                        plan["limit"] = max(1, min(plan["limit"], (end - start) // 2))
+                        if end - start > plan["limit"]:
+                            pending.append((start + plan["limit"], end))
+                            end = start + plan["limit"]
+                    await asyncio.sleep(_retry_delay(e, attempt))
+            if response is None:
+                vectors[start:end] = await asyncio.to_thread(fallback, texts[start:end])
+                continue
+            for item in response.data:
+                vectors[start + item.index] = item.embedding
+            plan["limit"] = min(max_batch_size, plan["limit"] + 1)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return np.array(vectors, dtype=np.float32)
+
+def embed_texts(texts, **kwargs):
+    """Synchronous wrapper around embed_texts_async"""
+    return asyncio.run(embed_texts_async(texts, **kwargs))
+
+def _async_client_for(embeddings_model):
+    """AsyncOpenAI client with the key, base URL, headers and timeout of an OpenAIEmbeddings model"""
+    api_key = embeddings_model.openai_api_key
+    if hasattr(api_key, "get_secret_value"):
+        api_key = api_key.get_secret_value()
+    return AsyncOpenAI(
+        api_key=api_key,
+        organization=embeddings_model.openai_organization,
+        base_url=embeddings_model.openai_api_base,
+        timeout=embeddings_model.request_timeout,
+        default_headers=embeddings_model.default_headers,
+        default_query=embeddings_model.default_query,
+        # Los reintentos los gestiona el pipeline, no el cliente
+        max_retries=0,
+    )
+
+async def _embed_documents_async(embeddings_model, texts):
+    async with _async_client_for(embeddings_model) as client:
+        return await embed_texts_async(
+            texts, model=embeddings_model.model, client=client,
+            dimensions=embeddings_model.dimensions, fallback=embeddings_model.embed_documents,
+        )
+
+def embed_with_model(embeddings_model, texts):
+    """Embed `texts` with an OpenAIEmbeddings model through the concurrent batch pipeline.
+
+    Texts that may exceed the model's context window go straight to the model's
+    embed_documents, which splits and averages them when check_embedding_ctx_length
+    is set, as does any batch the API rejects.
+    """
+    limit = embeddings_model.embedding_ctx_length if embeddings_model.check_embedding_ctx_length else None
+    oversized = [i for i, text in enumerate(texts) if limit and _estimate_tokens(text) > limit]
+    regular = sorted(set(range(len(texts))) - set(oversized))
+    parts = []
+    if regular:
+        parts.append((regular, asyncio.run(_embed_documents_async(embeddings_model, [texts[i] for i in regular]))))
+    if oversized:
+        split = embeddings_model.embed_documents([texts[i] for i in oversized])
+        parts.append((oversized, np.array(split, dtype=np.float32)))
+    vectors = np.zeros((len(texts), parts[0][1].shape[1]), dtype=np.float32)
+    for rows, part in parts:
+        vectors[rows] = part
+    return vectors
+
 def get_embeddings_langchain(embeddings_model, texts):
-    """Get embeddings using LangChain"""
+    """Get embeddings using LangChain, calling the API only for texts missing from the disk cache"""
     try:
         # Convert texts to LangChain Document objects if needed
         if isinstance(texts[0], str):
             documents = [Document(page_content=text) for text in texts]
         else:
             documents = texts
+        contents = [doc.page_content for doc in documents]
         
-        # Get embeddings using LangChain
-        embeddings = embeddings_model.embed_documents([doc.page_content for doc in documents])
-        return np.array(embeddings)
+        cache = get_embedding_cache(_embeddings_model_name(embeddings_model))
+        embeddings, missing = cache.lookup(contents)
+        if missing:
+            missing_texts = [contents[i] for i in missing]
+            if isinstance(embeddings_model, OpenAIEmbeddings):
+                # Lotes concurrentes con reintentos contra la API compatible con OpenAI
+                new_embeddings = embed_with_model(embeddings_model, missing_texts)
+            else:
+                # Get embeddings using LangChain
+                new_embeddings = np.array(embeddings_model.embed_documents(missing_texts), dtype=np.float32)
+            cache.add([contents[i] for i in missing], new_embeddings)
+            if embeddings is None:
+                embeddings = np.zeros((len(contents), new_embeddings.shape[1]), dtype=np.float32)
+            embeddings[missing] = new_embeddings
+        return embeddings
     except Exception as e:
         st.error(f"Error getting embeddings: {str(e)}")
         return None
 
+# --- Caché de embeddings de consultas ---
+class QueryEmbeddingCache:
+    """Bounded LRU cache with TTL for query embeddings, keyed by model and normalized query"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.casefold().split())
+
+    def get(self, model, query):
+        key = (model, self.normalize(query))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model, query, embedding):
+        key = (model, self.normalize(query))
+        with self._lock:
+            self.entries[key] = (time.monotonic(), embedding)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self.entries),
+        }
+
+@st.cache_resource
+def get_query_cache():
+    return QueryEmbeddingCache(
+        maxsize=int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("RAG_QUERY_CACHE_TTL", "3600")),
+    )
+
 def get_query_embedding_langchain(embeddings_model, query):
-    """Get query embedding using LangChain"""
+    """Get query embedding using LangChain, reusing recent embeddings of the same query.
+
+    Only calls to the model are recorded under the "embedding" span, so cache hits do
+    not skew its percentiles.
+    """
     try:
-        embedding = embeddings_model.embed_query(query)
-        return np.array(embedding)
+        cache = get_query_cache()
+        model = _embeddings_model_name(embeddings_model)
+        embedding = cache.get(model, query)
+        if embedding is None:
+            with latency_recorder.span("embedding"):
+                embedding = np.array(embeddings_model.embed_query(query))
+            cache.put(model, query, embedding)
+        return embedding
     except Exception as e:
         st.error(f"Error getting query embedding: {str(e)}")
         return None
 
-def evaluate_faithfulness(client, query, context, response):
-    if not client:
-        return 5.0
-        
-    eval_prompt = f"""Evalúa si la respuesta es fiel al contexto proporcionado.
+def get_query_embeddings_many(embeddings_model, queries):
+    """Embeddings for several queries: cached ones are reused and the rest go in a single
+    request, recorded under the "embedding.batch" span"""
+    cache = get_query_cache()
+    model = _embeddings_model_name(embeddings_model)
+    embeddings = [cache.get(model, query) for query in queries]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        # Consultas repetidas dentro del lote se embeben una sola vez
+        unique = list(dict.fromkeys(QueryEmbeddingCache.normalize(queries[i]) for i in missing))
+        originals = {QueryEmbeddingCache.normalize(queries[i]): queries[i] for i in missing}
+        with latency_recorder.span("embedding.batch"):
+            vectors = dict(zip(unique, embeddings_model.embed_documents([originals[key] for key in unique])))
+        for i in missing:
+            embeddings[i] = np.array(vectors[QueryEmbeddingCache.normalize(queries[i])])
+            cache.put(model, queries[i], embeddings[i])
+    return np.array(embeddings, dtype=np.float32)
+
+# --- Índice invertido BM25 ---
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring, kept in document order.
+
+    Documents get an internal id that never changes; `doc_ids[position]` maps the
+    position in the document list to that id and `positions[id]` maps it back (-1
+    once deleted). Adding or deleting a document only touches the postings of its
+    own terms, and a query only reads the postings of the query terms.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        # Vista en arrays de cada lista de postings, regenerada solo si el término cambia
+        self._arrays = {}
+        self.doc_ids = []
+        self.doc_lengths = np.zeros(64, dtype=np.float32)
+        self.positions = np.full(64, -1, dtype=np.int64)
+        self.total_length = 0
+        self.next_id = 0
+
+    @classmethod
+    def from_documents(cls, documents, **kwargs):
+        index = cls(**kwargs)
+        for document in documents:
+            index.add(document)
+        return index
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def _insert(self, text):
+        doc_id = self.next_id
+        self.next_id += 1
+        if doc_id >= len(self.doc_lengths):
+            self.doc_lengths = np.concatenate([self.doc_lengths, np.zeros(len(self.doc_lengths), dtype=np.float32)])
+            self.positions = np.concatenate([self.positions, np.full(len(self.positions), -1, dtype=np.int64)])
+        terms = tokenize(text)
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+        for term, frequency in collections.Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+            self._arrays.pop(term, None)
+        return doc_id
+
+    def _remove(self, doc_id, text):
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is not None and postings.pop(doc_id, None) is not None:
+                self._arrays.pop(term, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= int(self.doc_lengths[doc_id])
+        self.doc_lengths[doc_id] = 0
+        self.positions[doc_id] = -1
+
+    def add(self, text):
+        doc_id = self._insert(text)
+        self.positions[doc_id] = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+
+    def update(self, position, old_text, new_text):
+        self._remove(self.doc_ids[position], old_text)
+        doc_id = self._insert(new_text)
+        self.positions[doc_id] = position
+        self.doc_ids[position] = doc_id
+
+    def delete(self, position, text):
+        self._remove(self.doc_ids.pop(position), text)
+        # Los documentos posteriores retroceden una posición
+        self.positions[self.positions > position] -= 1
+
+    def _term_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self.postings[term]
+            arrays = (np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                      np.fromiter(postings.values(), dtype=np.float32, count=len(postings)))
+            self._arrays[term] = arrays
+        return arrays
+
+    def scores(self, query):
+        """BM25 score of every document in document order, normalized to [0, 1]"""
+        count = len(self.doc_ids)
+        scores = np.zeros(count, dtype=np.float32)
+        if not count:
+            return scores
+        average_length = max(self.total_length / count, 1e-9)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, frequencies = self._term_arrays(term)
+            idf = np.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[ids] / average_length)
+            scores[self.positions[ids]] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+        top = scores.max()
+        return scores / top if top > 0 else scores
+
+    def scores_many(self, queries):
+        """scores() for several queries at once: the postings of each distinct term are
+        read and scored once and added to every query that contains the term"""
+        count = len(self.doc_ids)
+        scores = np.zeros((len(queries), count), dtype=np.float32)
+        if not count:
+            return scores
+        average_length = max(self.total_length / count, 1e-9)
+        queries_by_term = collections.defaultdict(list)
+        for i, query in enumerate(queries):
+            for term in set(tokenize(query)):
+                queries_by_term[term].append(i)
+        for term, query_rows in queries_by_term.items():
+            if term not in self.postings:
+                continue
+            ids, frequencies = self._term_arrays(term)
+            idf = np.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[ids] / average_length)
+            contribution = idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+            scores[np.ix_(query_rows, self.positions[ids])] += contribution
+        top = scores.max(axis=1, keepdims=True)
+        return scores / np.where(top > 0, top, 1)
+
+# --- Matriz de embeddings con actualizaciones por fila ---
+def normalize_rows(vectors):
+    """L2-normalized float32 copy of `vectors` (zero rows stay zero)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+def top_k_indices(scores, k):
+    """Indices of the `k` highest scores, best first, without sorting every score"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class EmbeddingMatrix:
+    """Embedding matrix that supports row-level add, update and delete.
+
+    Rows are L2-normalized float32 vectors, so cosine similarity is a single
+    matrix-vector product. They are stored in insertion order in a preallocated
+    buffer that grows by doubling. Deleted documents leave a tombstone
+    (`alive[row] = False`) and the buffer is compacted once tombstones exceed
+    `compact_ratio` of the rows, so every mutation costs one row write plus
+    amortized O(1) copying. An optional ANN index (`ann`) is kept in sync.
+    """
+
+    def __init__(self, dim, capacity=64, compact_ratio=0.25):
+        self.data = np.zeros((capacity, dim), dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        # doc_rows[i] es la fila del documento en la posición i de la lista de documentos
+        self.doc_rows = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+        self.compact_ratio = compact_ratio
+        self.ann = None
+        self._version = 0
+        self._row_positions = (-1, None)
+
+    @classmethod
+    def from_array(cls, vectors):
+        vectors = normalize_rows(vectors)
+        matrix = cls(vectors.shape[1], capacity=max(64, len(vectors)))
+        matrix.data[:len(vectors)] = vectors
+        matrix.alive[:len(vectors)] = True
+        matrix.doc_rows[:len(vectors)] = np.arange(len(vectors))
+        matrix.size = matrix.count = len(vectors)
+        return matrix
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def dim(self):
+        return self.data.shape[1]
+
+    def _grow(self, needed):
+        capacity = len(self.data)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        data = np.zeros((capacity, self.dim), dtype=np.float32)
+        data[:self.size] = self.data[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.data, self.alive = data, alive
+
+    def append(self, vector):
+        self._grow(self.size + 1)
+        if self.count == len(self.doc_rows):
+            self.doc_rows = np.concatenate([self.doc_rows, np.zeros(len(self.doc_rows), dtype=np.int64)])
+        self.data[self.size] = normalize_rows(vector)
+        self.alive[self.size] = True
+        self.doc_rows[self.count] = self.size
+        self.size += 1
+        self.count += 1
+        self._version += 1
+        if self.ann is not None:
+            self.ann.add(self.size - 1)
+
+    def update(self, position, vector):
+        row = self.doc_rows[position]
+        self.data[row] = normalize_rows(vector)
+        if self.ann is not None:
+            self.ann.update(row)
+
+    def delete(self, position):
+        row = self.doc_rows[position]
+        self.alive[row] = False
+        if self.ann is not None:
+            self.ann.remove(row)
+        self.doc_rows[position:self.count - 1] = self.doc_rows[position + 1:self.count]
+        self.count -= 1
+        self._version += 1
+        if self.size - self.count > self.compact_ratio * self.size:
+            self.compact()
+
+    def compact(self):
+        """Drop tombstoned rows, leaving the live rows in document order"""
+        rows = self.doc_rows[:self.count].copy()
+        self.data[:self.count] = self.data[rows]
+        self.alive[:] = False
+        self.alive[:self.count] = True
+        self.doc_rows[:self.count] = np.arange(self.count)
+        self.size = self.count
+        self._version += 1
+        if self.ann is not None:
+            self.ann.remap(rows)
+
+    def row_positions(self):
+        """Document position of every row (-1 for tombstones), rebuilt only after mutations"""
+        version, positions = self._row_positions
+        if version != self._version:
+            positions = np.full(self.size, -1, dtype=np.int64)
+            positions[self.doc_rows[:self.count]] = np.arange(self.count)
+            self._row_positions = (self._version, positions)
+        return positions
+
+    def vectors(self):
+        """Live (normalized) vectors in document order"""
+        return self.data[self.doc_rows[:self.count]]
+
+    def similarities(self, query_embedding):
+        """Cosine similarity of the query with every document, in document order"""
+        scores = self.data[:self.size] @ normalize_rows(query_embedding)
+        return scores[self.doc_rows[:self.count]]
+
+    def similarities_many(self, query_embeddings):
+        """similarities() for a block of queries with one matrix-matrix product: (queries, documents)"""
+        scores = normalize_rows(query_embeddings) @ self.data[:self.size].T
+        return scores[:, self.doc_rows[:self.count]]
+
+    def approximate_similarities(self, query_embedding, candidates=None, extra_positions=()):
+        """Like similarities(), but only the ANN candidates and `extra_positions` are
+        scored; every other document gets -1 (the lowest possible cosine)"""
+        query = normalize_rows(query_embedding)
+        rows, _ = self.ann.search(query, candidates or ANN_CANDIDATES)
+        positions = np.union1d(self.row_positions()[rows], np.asarray(extra_positions, dtype=np.int64))
+        scores = np.full(self.count, -1.0, dtype=np.float32)
+        scores[positions] = self.data[self.doc_rows[positions]] @ query
+        return scores
+
+# --- Índice aproximado de vecinos (IVF) ---
+# Por encima de ANN_THRESHOLD documentos la búsqueda semántica solo puntúa los candidatos del índice
+ANN_THRESHOLD = int(os.getenv("RAG_ANN_THRESHOLD", "50000"))
+ANN_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "16"))
+ANN_CANDIDATES = int(os.getenv("RAG_ANN_CANDIDATES", "200"))
+
+class IVFIndex:
+    """NumPy inverted-file index over the rows of an EmbeddingMatrix.
+
+    Rows are assigned to the nearest of `nlist` spherical k-means centroids and a
+    query only scores the rows of its `nprobe` closest lists: a larger `nprobe`
+    raises recall at the cost of speed. Added or rewritten rows are searched from
+    a pending list until the lists are regrouped.
+    """
+
+    def __init__(self, matrix, nlist=None, nprobe=None, centroids=None, seed=0):
+        self.matrix = matrix
+        self.nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+        self.nprobe = nprobe or ANN_NPROBE
+        self.rng = np.random.default_rng(seed)
+        self.centroids = centroids if centroids is not None else self.train()
+        self.nlist = len(self.centroids)
+        self.assignments = np.zeros(len(matrix.data), dtype=np.int64)
+        self.assignments[:matrix.size] = self._assign(matrix.data[:matrix.size])
+        self._regroup()
+
+    def train(self, iterations=10, sample_per_list=64):
+        live = np.flatnonzero(self.matrix.alive[:self.matrix.size])
+        sample = self.matrix.data[self.rng.choice(live, min(len(live), self.nlist * sample_per_list), replace=False)]
+        centroids = sample[self.rng.choice(len(sample), min(self.nlist, len(sample)), replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=len(centroids)) == 0
+            # Las listas vacías se reinician con un vector al azar de la muestra
+            sums[empty] = sample[self.rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _assign(self, vectors, batch=65536):
+        return np.concatenate([
+            np.argmax(vectors[start:start + batch] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), batch)
+        ] or [np.empty(0, dtype=np.int64)])
+
+    def _regroup(self):
+        size = self.matrix.size
+        self.order = np.argsort(self.assignments[:size], kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assignments[:size], minlength=self.nlist))])
+        self.pending = set()
+
+    def add(self, row):
+        if row >= len(self.assignments):
+            self.assignments = np.concatenate([self.assignments, np.zeros(len(self.assignments) + 1, dtype=np.int64)])
+        self.assignments[row] = self._assign(self.matrix.data[row:row + 1])[0]
+        self.pending.add(row)
+        if len(self.pending) > max(1024, 0.05 * self.matrix.size):
+            self._regroup()
+
+    update = add
+
+    def remove(self, row):
+        # Las filas borradas se descartan al buscar gracias a `alive`
+        pass
+
+    def remap(self, rows):
+        """Follow a compaction of the matrix: `rows[i]` is the old row now stored at row i"""
+        assignments = self.assignments[rows]
+        self.assignments[:] = 0
+        self.assignments[:len(rows)] = assignments
+        self._regroup()
+
+    def search(self, query, k):
+        """Return (rows, scores) of the best `k` live rows among the probed lists"""
+        probed = top_k_indices(self.centroids @ query, self.nprobe)
+        probed_mask = np.zeros(self.nlist, dtype=bool)
+        probed_mask[probed] = True
+        parts = [self.order[self.offsets[l]:self.offsets[l + 1]] for l in probed]
+        if self.pending:
+            parts.append(np.fromiter(self.pending, dtype=np.int64, count=len(self.pending)))
+        rows = np.unique(np.concatenate(parts))
+        rows = rows[probed_mask[self.assignments[rows]] & self.matrix.alive[rows]]
+        scores = self.matrix.data[rows] @ query
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, path):
+        np.save(path, self.centroids)
+
+class FaissIVFIndex:
+    """Same interface as IVFIndex backed by faiss.IndexIVFFlat (inner product)"""
+
+    def __init__(self, matrix, nlist=None, nprobe=None, trained_path=None):
+        self.matrix = matrix
+        nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+        if trained_path and os.path.exists(trained_path):
+            self.index = faiss.read_index(trained_path)
+        else:
+            quantizer = faiss.IndexFlatIP(matrix.dim)
+            self.index = faiss.IndexIVFFlat(quantizer, matrix.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(matrix.vectors())
+            if trained_path:
+                # Se guarda el índice entrenado pero vacío: las filas dependen de cada sesión
+                faiss.write_index(self.index, trained_path)
+        self.index.nprobe = nprobe or ANN_NPROBE
+        self._add_live_rows()
+
+    def _add_live_rows(self):
+        rows = np.flatnonzero(self.matrix.alive[:self.matrix.size])
+        self.index.add_with_ids(self.matrix.data[rows], rows.astype(np.int64))
+
+    def add(self, row):
+        self.index.add_with_ids(self.matrix.data[row:row + 1], np.array([row], dtype=np.int64))
+
+    def update(self, row):
+        self.remove(row)
+        self.add(row)
+
+    def remove(self, row):
+        self.index.remove_ids(np.array([row], dtype=np.int64))
+
+    def remap(self, rows):
+        self.index.reset()
+        self._add_live_rows()
+
+    def search(self, query, k):
+        scores, rows = self.index.search(query.reshape(1, -1), k)
+        keep = rows[0] >= 0
+        return rows[0][keep], scores[0][keep]
+
+def _corpus_fingerprint(matrix):
+    """Row count plus a hash of the live vectors, so trained centroids are tied to one corpus"""
+    digest = hashlib.blake2b(digest_size=8)
+    rows = matrix.doc_rows[:matrix.count]
+    for start in range(0, len(rows), 65536):
+        digest.update(matrix.data[rows[start:start + 65536]].tobytes())
+    return f"{len(matrix)}-{digest.hexdigest()}"
+
+def build_ann_index(matrix, model, nlist=None, nprobe=None):
+    """Build the ANN index for `matrix`, reusing the trained centroids stored next to the embedding cache"""
+    nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+    directory = get_embedding_cache(model).directory
+    os.makedirs(directory, exist_ok=True)
+    name = f"ivf-{nlist}-{_corpus_fingerprint(matrix)}"
+    # Los centroides de otros corpus ya no sirven: se borran para que no se acumulen
+    for stale in os.listdir(directory):
+        if stale.startswith("ivf-") and os.path.splitext(stale)[0] != name:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directory, stale))
+    if faiss is not None:
+        return FaissIVFIndex(matrix, nlist, nprobe, os.path.join(directory, f"{name}.faiss"))
+    path = os.path.join(directory, f"{name}.npy")
+    centroids = None
+    if os.path.exists(path):
+        centroids = np.load(path)
+        if centroids.shape[1] != matrix.dim:
+            centroids = None
+    index = IVFIndex(matrix, nlist, nprobe, centroids)
+    if centroids is None:
+        index.save(path)
+    return index
+
+def add_document(state, text, vector=None):
+    """Append a document and, if the matrix exists, its embedding row"""
+    state['documents'].append(text)
+    state['keyword_index'].add(text)
+    if state['embeddings'] is not None:
+        if vector is None:
+            vector = _embed_one(state, text)
+        if vector is None:
+            state['embeddings'] = None
+        else:
+            state['embeddings'].append(vector)
+
+def update_document(state, position, text):
+    """Replace a document, embedding only the new text and rewriting its row"""
+    state['keyword_index'].update(position, state['documents'][position], text)
+    state['documents'][position] = text
+    if state['embeddings'] is not None:
+        vector = _embed_one(state, text)
+        if vector is None:
+            state['embeddings'] = None
+        else:
+            state['embeddings'].update(position, vector)
+
+def delete_document(state, position):
+    """Remove a document and tombstone its embedding row"""
+    state['keyword_index'].delete(position, state['documents'].pop(position))
+    if state['embeddings'] is not None:
+        state['embeddings'].delete(position)
+
+def _embed_one(state, text):
+    if state['embeddings_model'] is None:
+        return None
+    vectors = get_embeddings_langchain(state['embeddings_model'], [text])
+    return None if vectors is None else vectors[0]
+
+# --- Jueces LLM ---
+JUDGE_MODEL = "gpt-4o"
+JUDGE_CONCURRENCY = int(os.getenv("RAG_JUDGE_CONCURRENCY", "8"))
+JUDGE_RPM = float(os.getenv("RAG_JUDGE_RPM", "60"))
+
+def _faithfulness_prompt(query, context, response):
+    return f"""Evalúa si la respuesta es fiel al contexto proporcionado.
 
 Consulta: {query}
 
@@ -112,22 +1100,8 @@ Responde con un número del 1-10 donde:
 
 Responde SOLO con el número:"""
 
-    try:
-        result = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": eval_prompt}],
-            temperature=0.1,
-            max_tokens=10
-        )
-        return float(result.choices[0].message.content.strip())
-    except:
-        return 5.0
-
-def evaluate_relevance(client, query, response):
-    if not client:
-        return 5.0
-        
-    eval_prompt = f"""Evalúa qué tan relevante es la respuesta para la consulta.
+def _relevance_prompt(query, response):
+    return f"""Evalúa qué tan relevante es la respuesta para la consulta.
 
 Consulta: {query}
 
@@ -141,46 +1115,353 @@ Responde con un número del 1-10 donde:
 
 Responde SOLO con el número:"""
 
+def _document_relevance_prompt(query, document):
+    return f"""¿Este documento es relevante para responder la consulta?
+
+Consulta: {query}
+
+Documento: {document[:300]}...
+
+Responde SOLO 'SI' o 'NO':"""
+
+def _batch_relevance_prompt(query, documents):
+    listed = "\n\n".join(f"Documento {i+1}: {document[:300]}..." for i, document in enumerate(documents))
+    return f"""¿Cuáles de estos documentos son relevantes para responder la consulta?
+
+Consulta: {query}
+
+{listed}
+
+Responde SOLO con una lista JSON con 'SI' o 'NO' para cada uno de los {len(documents)} documentos, en el mismo orden. Ejemplo: ["SI", "NO", "SI"]"""
+
+def _parse_verdicts(text, count):
+    """List of booleans parsed from the batched judge answer, or None if it is not a valid verdict list"""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return None
     try:
-        result = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": eval_prompt}],
-            temperature=0.1,
-            max_tokens=10
+        verdicts = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(verdicts, list) or len(verdicts) != count:
+        return None
+    parsed = []
+    for verdict in verdicts:
+        if isinstance(verdict, bool):
+            parsed.append(verdict)
+        elif isinstance(verdict, str) and verdict.strip().upper() in ("SI", "SÍ", "NO"):
+            parsed.append(verdict.strip().upper() != "NO")
+        else:
+            return None
+    return parsed
+
+def _batch_max_tokens(count):
+    return 8 * count + 10
+
+# --- Caché persistente de puntuaciones de los jueces ---
+# Cambiar un prompt exige subir su versión para no reutilizar puntuaciones antiguas
+JUDGE_PROMPT_VERSIONS = {"faithfulness": 1, "relevance": 1, "context_precision": 2}
+JUDGE_CACHE_PATH = os.getenv("RAG_JUDGE_CACHE", os.path.join(EMBEDDING_CACHE_DIR, "judges.sqlite"))
+
+class JudgeCache:
+    """SQLite cache of judge scores keyed by the SHA-256 of
+    (judge, prompt version, model, query, context, response), with hit/miss counters per judge"""
+
+    def __init__(self, path=None):
+        self.path = path or JUDGE_CACHE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS judge_scores (key BLOB PRIMARY KEY, judge TEXT, score REAL, created REAL)"
         )
-        return float(result.choices[0].message.content.strip())
-    except:
-        return 5.0
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        self._lock = threading.Lock()
 
-def evaluate_context_precision(client, query, retrieved_docs):
-    if not client or not retrieved_docs:
-        return 0.0
-    
-    relevant_count = 0
-    for doc in retrieved_docs:
-        eval_prompt = f"""¿Este documento es relevante para responder la consulta?
+    @staticmethod
+    def key(judge, query, context, response):
+        payload = json.dumps([judge, JUDGE_PROMPT_VERSIONS[judge], JUDGE_MODEL, query, context, response], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).digest()
 
-Consulta: {query}
+    def get(self, judge, query, context="", response=""):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT score FROM judge_scores WHERE key = ?", (self.key(judge, query, context, response),)
+            ).fetchone()
+            (self.hits if row else self.misses)[judge] += 1
+        return row[0] if row else None
 
-Documento: {doc['document'][:300]}...
+    def put(self, judge, query, context, response, score):
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO judge_scores VALUES (?, ?, ?, ?)",
+                (self.key(judge, query, context, response), judge, score, time.time())
+            )
 
-Responde SOLO 'SI' o 'NO':"""
-        
+    def stats(self):
+        """Hits, misses and hit rate per judge (and 'total') since the process started"""
+        with self._lock:
+            judges = sorted(set(self.hits) | set(self.misses))
+            rows = {judge: (self.hits[judge], self.misses[judge]) for judge in judges}
+        rows['total'] = (sum(hits for hits, _ in rows.values()), sum(misses for _, misses in rows.values()))
+        return {
+            judge: {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+            for judge, (hits, misses) in rows.items()
+        }
+
+def judge_cache_delta(before, after):
+    """Hit statistics of the judge calls made between two JudgeCache.stats() snapshots"""
+    delta = {}
+    for judge, current in after.items():
+        previous = before.get(judge, {'hits': 0, 'misses': 0})
+        hits, misses = current['hits'] - previous['hits'], current['misses'] - previous['misses']
+        delta[judge] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+    return delta
+
+@st.cache_resource
+def get_judge_cache():
+    """Shared judge cache (one SQLite connection and its counters) for every session of the app"""
+    return JudgeCache()
+
+def _documents_key(retrieved_docs):
+    return json.dumps([doc['document'] for doc in retrieved_docs], ensure_ascii=False)
+
+class RequestRateLimiter:
+    """Token-bucket requests-per-minute limiter shared by every event loop and session.
+
+    Up to `burst` requests go out at once and the bucket refills at rpm/60 tokens
+    per second. Each request takes its token under a thread lock (the balance may
+    go negative, which books a later slot) and then sleeps until its slot, so it
+    does not depend on the event loop that awaits it.
+    """
+
+    def __init__(self, rpm, burst=None):
+        self.rate = rpm / 60.0 if rpm and rpm > 0 else 0.0
+        self.burst = burst or max(1.0, rpm / 6.0) if self.rate else 0.0
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def wait(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        await asyncio.sleep(delay)
+
+class ConcurrencyLimiter:
+    """Caps the requests in flight across every event loop and session.
+
+    Slots are counted under a thread lock; a request that finds none waits on a
+    future of its own loop, and each release hands its slot straight to the oldest
+    waiter through `call_soon_threadsafe`.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self.limit and not self.waiters:
+                self.active += 1
+                return
+            future = loop.create_future()
+            self.waiters.append((loop, future))
         try:
-            result = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": eval_prompt}],
-                temperature=0.1,
-                max_tokens=5
-            )
-            if result.choices[0].message.content.strip().upper() == 'SI':
-                relevant_count += 1
-        except:
-            pass
-    
-    return relevant_count / len(retrieved_docs)
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                # Si ya se le había cedido el hueco, _grant lo libera al ver la cancelación
+                if (loop, future) in self.waiters:
+                    self.waiters.remove((loop, future))
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        with self._lock:
+            while self.waiters:
+                loop, future = self.waiters.popleft()
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+            self.active -= 1
+
+    def _grant(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+@st.cache_resource
+def get_judge_limits():
+    """Judge calls in flight and per minute, shared by every session, rerun and runner of the process"""
+    return ConcurrencyLimiter(JUDGE_CONCURRENCY), RequestRateLimiter(JUDGE_RPM)
+
+class JudgeEngine:
+    """Runs LLM-as-judge calls concurrently under the process-wide `get_judge_limits()`:
+    at most JUDGE_CONCURRENCY calls in flight and JUDGE_RPM requests per minute.
+    `concurrency` and `limiter` replace them with limits private to this engine.
+
+    A failed judge call scores the default value, unless `strict` is set: then it
+    raises, so callers that persist results can leave the case to be retried."""
+
+    def __init__(self, client=None, concurrency=None, limiter=None, max_retries=3, cache=None, strict=False):
+        shared_concurrency, shared_limiter = get_judge_limits()
+        self._owns_client = client is None
+        self.client = client or AsyncOpenAI(base_url=github_base_url, api_key=github_token, max_retries=0)
+        self.concurrency = ConcurrencyLimiter(concurrency) if concurrency else shared_concurrency
+        self.limiter = limiter or shared_limiter
+        self.max_retries = max_retries
+        self.cache = cache or get_judge_cache()
+        self.strict = strict
+
+    async def close(self):
+        """Close the client if this engine created it"""
+        if self._owns_client:
+            await self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def complete(self, prompt, max_tokens):
+        async with self.concurrency:
+            for attempt in range(self.max_retries + 1):
+                await self.limiter.wait()
+                try:
+                    result = await self.client.chat.completions.create(
+                        model=JUDGE_MODEL,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.1,
+                        max_tokens=max_tokens
+                    )
+                    return result.choices[0].message.content.strip()
+                except openai.RateLimitError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(_retry_delay(e, attempt))
+
+    async def score(self, judge, prompt, query, context="", response="", default=5.0):
+        cached = self.cache.get(judge, query, context, response)
+        if cached is not None:
+            return cached
+        try:
+            score = float(await self.complete(prompt, 10))
+        except Exception:
+            if self.strict:
+                raise
+            return default
+        self.cache.put(judge, query, context, response, score)
+        return score
+
+    @timed("judge.faithfulness")
+    async def faithfulness(self, query, context, response):
+        return await self.score("faithfulness", _faithfulness_prompt(query, context, response), query, context, response)
+
+    @timed("judge.relevance")
+    async def relevance(self, query, response):
+        return await self.score("relevance", _relevance_prompt(query, response), query, "", response)
+
+    @timed("judge.context_precision")
+    async def context_precision(self, query, retrieved_docs, batched=True):
+        if not retrieved_docs:
+            return 0.0
+        documents_key = _documents_key(retrieved_docs)
+        cached = self.cache.get("context_precision", query, documents_key)
+        if cached is not None:
+            return cached
+
+        if batched:
+            try:
+                answer = await self.complete(
+                    _batch_relevance_prompt(query, [doc['document'] for doc in retrieved_docs]),
+                    _batch_max_tokens(len(retrieved_docs))
+                )
+                verdicts = _parse_verdicts(answer, len(retrieved_docs))
+                if verdicts is not None:
+                    score = sum(verdicts) / len(retrieved_docs)
+                    self.cache.put("context_precision", query, documents_key, "", score)
+                    return score
+            except Exception:
+                pass
+            # Respuesta no interpretable: se pregunta documento a documento
+
+        async def is_relevant(doc):
+            try:
+                return (await self.complete(_document_relevance_prompt(query, doc['document']), 5)).upper() == 'SI'
+            except Exception:
+                return None
+
+        verdicts = await asyncio.gather(*(is_relevant(doc) for doc in retrieved_docs))
+        if self.strict and None in verdicts:
+            raise RuntimeError(f"{verdicts.count(None)} veredictos de relevancia fallidos")
+        score = sum(bool(verdict) for verdict in verdicts) / len(retrieved_docs)
+        # Las puntuaciones con llamadas fallidas no se guardan para volver a intentarlas
+        if None not in verdicts:
+            self.cache.put("context_precision", query, documents_key, "", score)
+        return score
+
+    async def evaluate(self, query, context, response, retrieved_docs):
+        """Faithfulness, relevance and context precision of one answer, all in flight at once"""
+        faithfulness, relevance, context_precision = await asyncio.gather(
+            self.faithfulness(query, context, response),
+            self.relevance(query, response),
+            self.context_precision(query, retrieved_docs),
+        )
+        return {'faithfulness': faithfulness, 'relevance': relevance, 'context_precision': context_precision}
+
+async def evaluate_many_async(cases, client=None, concurrency=None):
+    """Judge several (query, context, response, retrieved_docs) cases under one shared concurrency limit"""
+    async with JudgeEngine(client, concurrency) as engine:
+        return await asyncio.gather(*(engine.evaluate(*case) for case in cases))
+
+def evaluate_many(cases, **kwargs):
+    """Synchronous wrapper around evaluate_many_async, returns one metrics dict per case"""
+    if not github_token and kwargs.get("client") is None:
+        return [{'faithfulness': 5.0, 'relevance': 5.0, 'context_precision': 0.0} for _ in cases]
+    return asyncio.run(evaluate_many_async(cases, **kwargs))
+
+def evaluate_response(query, context, response, retrieved_docs, **kwargs):
+    return evaluate_many([(query, context, response, retrieved_docs)], **kwargs)[0]
+
+def _judge_sync(client, judge, *args):
+    """Run one JudgeEngine judge from synchronous code with the endpoint and key of a sync OpenAI client"""
+    async def run():
+        async with AsyncOpenAI(base_url=client.base_url, api_key=client.api_key, max_retries=0) as async_client:
+            return await getattr(JudgeEngine(async_client), judge)(*args)
+    return asyncio.run(run())
+
+def evaluate_faithfulness(client, query, context, response):
+    if not client:
+        return 5.0
+    return _judge_sync(client, "faithfulness", query, context, response)
+
+def evaluate_relevance(client, query, response):
+    if not client:
+        return 5.0
+    return _judge_sync(client, "relevance", query, response)
 
-def hybrid_search_with_metrics(query, documents, embeddings, embeddings_model, client, top_k=5):
+def evaluate_context_precision(client, query, retrieved_docs, batched=True):
+    """Fraction of retrieved documents judged relevant (see JudgeEngine.context_precision)"""
+    if not client:
+        return 0.0
+    return _judge_sync(client, "context_precision", query, retrieved_docs, batched)
+
+@timed("retrieval")
+def hybrid_search_with_metrics(query, documents, embeddings, embeddings_model, client, top_k=5, keyword_index=None):
     start_time = time.time()
     
     # Use LangChain for query embedding
@@ -188,17 +1469,36 @@ def hybrid_search_with_metrics(query, documents, embeddings, embeddings_model, c
     if query_embedding is None:
         return [], 0.0
     
-    semantic_similarities = cosine_similarity([query_embedding], embeddings)[0]
+    # Streamlit reejecuta el script en cada interacción: las matrices guardadas en session_state
+    # son de una definición anterior de EmbeddingMatrix, así que solo se envuelven los arrays.
+    # Un array envuelto se descarta tras la consulta y su índice ANN habría que entrenarlo en
+    # cada llamada: el índice solo se usa con una EmbeddingMatrix, que lo conserva
+    use_ann = not isinstance(embeddings, np.ndarray) and len(embeddings) >= ANN_THRESHOLD
+    if isinstance(embeddings, np.ndarray):
+        embeddings = EmbeddingMatrix.from_array(embeddings)
     
-    keyword_scores = []
-    query_words = set(query.lower().split())
-    for doc in documents:
-        doc_words = set(doc.lower().split())
-        overlap = len(query_words.intersection(doc_words))
-        keyword_scores.append(overlap / max(len(query_words), 1))
+    # BM25 sobre el índice invertido: solo se recorren los postings de los términos de la consulta
+    if keyword_index is None:
+        keyword_index = BM25Index.from_documents(documents)
+    with latency_recorder.span("keyword_scoring"):
+        keyword_scores = keyword_index.scores(query)
     
-    combined_scores = 0.7 * semantic_similarities + 0.3 * np.array(keyword_scores)
-    top_indices = np.argsort(combined_scores)[::-1][:top_k]
+    if use_ann:
+        if embeddings.ann is None:
+            embeddings.ann = build_ann_index(embeddings, _embeddings_model_name(embeddings_model))
+        with latency_recorder.span("semantic_scoring"):
+            # Los mejores documentos por BM25 también se puntúan aunque el índice no los proponga
+            keyword_candidates = top_k_indices(keyword_scores, ANN_CANDIDATES)
+            semantic_similarities = embeddings.approximate_similarities(
+                query_embedding, extra_positions=keyword_candidates[keyword_scores[keyword_candidates] > 0]
+            )
+    else:
+        with latency_recorder.span("semantic_scoring"):
+            semantic_similarities = embeddings.similarities(query_embedding)
+    
+    with latency_recorder.span("top_k"):
+        combined_scores = 0.7 * semantic_similarities + 0.3 * keyword_scores
+        top_indices = top_k_indices(combined_scores, top_k)
     
     results = []
     for idx in top_indices:
@@ -214,22 +1514,99 @@ def hybrid_search_with_metrics(query, documents, embeddings, embeddings_model, c
     
     return results, retrieval_time
 
-def generate_response_with_metrics(client, query, context_docs):
-    if not client:
-        return "Error: Cliente no disponible", 0.0
-        
+def top_k_rows(scores, k):
+    """top_k_indices() applied to every row of a 2-D score matrix"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else \
+        np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+# Tamaño máximo (en celdas float32) de cada bloque de puntuaciones consultas x documentos
+SEARCH_BLOCK_CELLS = 1 << 24
+
+@timed("retrieval.batch")
+def hybrid_search_many(queries, documents, embeddings, embeddings_model, top_k=5, keyword_index=None):
+    """Batched hybrid_search_with_metrics: one embedding request for all queries, one
+    matrix-matrix product and one BM25 pass per block of queries.
+
+    Returns (results per query, total retrieval time).
+    """
     start_time = time.time()
+    if not queries:
+        return [], 0.0
+    try:
+        query_embeddings = get_query_embeddings_many(embeddings_model, queries)
+    except Exception as e:
+        st.error(f"Error getting query embeddings: {str(e)}")
+        return [[] for _ in queries], time.time() - start_time
+    
+    # Solo se envuelven los arrays, que nunca usan el índice ANN (ver hybrid_search_with_metrics)
+    use_ann = not isinstance(embeddings, np.ndarray) and len(embeddings) >= ANN_THRESHOLD
+    if isinstance(embeddings, np.ndarray):
+        embeddings = EmbeddingMatrix.from_array(embeddings)
+    if keyword_index is None:
+        keyword_index = BM25Index.from_documents(documents)
+    if use_ann and embeddings.ann is None:
+        embeddings.ann = build_ann_index(embeddings, _embeddings_model_name(embeddings_model))
+    
+    all_results = []
+    # Bloques de consultas para acotar la memoria de las matrices consultas x documentos;
+    # cada bloque se registra como una muestra de las etapas ".batch"
+    block = max(1, SEARCH_BLOCK_CELLS // max(len(documents), 1))
+    for first in range(0, len(queries), block):
+        block_queries = queries[first:first + block]
+        with latency_recorder.span("keyword_scoring.batch"):
+            keyword_scores = keyword_index.scores_many(block_queries)
+        with latency_recorder.span("semantic_scoring.batch"):
+            if use_ann:
+                semantic_similarities = np.empty_like(keyword_scores)
+                for i, query_embedding in enumerate(query_embeddings[first:first + block]):
+                    keyword_candidates = top_k_indices(keyword_scores[i], ANN_CANDIDATES)
+                    semantic_similarities[i] = embeddings.approximate_similarities(
+                        query_embedding, extra_positions=keyword_candidates[keyword_scores[i][keyword_candidates] > 0]
+                    )
+            else:
+                semantic_similarities = embeddings.similarities_many(query_embeddings[first:first + block])
+        with latency_recorder.span("top_k.batch"):
+            combined_scores = 0.7 * semantic_similarities + 0.3 * keyword_scores
+            block_top_indices = top_k_rows(combined_scores, top_k)
+        for i, top_indices in enumerate(block_top_indices):
+            all_results.append([
+                {
+                    'document': documents[idx],
+                    'semantic_score': semantic_similarities[i, idx],
+                    'keyword_score': keyword_scores[i, idx],
+                    'combined_score': combined_scores[i, idx],
+                    'index': idx
+                }
+                for idx in top_indices
+            ])
     
+    return all_results, time.time() - start_time
+
+def _generation_prompt(query, context_docs):
     context = "".join([f"Documento {i+1}: {doc['document']}" 
                           for i, doc in enumerate(context_docs)])
     
-    prompt = f"""Contexto:
+    return f"""Contexto:
 {context}
 
 Pregunta: {query}
 
 Responde basándote únicamente en el contexto proporcionado."""
 
+@timed("generation")
+def generate_response_with_metrics(client, query, context_docs):
+    if not client:
+        return "Error: Cliente no disponible", 0.0
+        
+    start_time = time.time()
+    
+    prompt = _generation_prompt(query, context_docs)
+
     try:
         response = client.chat.completions.create(
             model="gpt-4o",
@@ -245,6 +1622,91 @@ Responde basándote únicamente en el contexto proporcionado."""
     except Exception as e:
         return f"Error generating response: {str(e)}", time.time() - start_time
 
+class GenerationStream:
+    """Iterable over the text chunks of a streamed completion (usable with `st.write_stream`)
+    that times them: time to first token, mean inter-token latency and decode tokens/second.
+
+    After iteration, `text` holds the whole answer and `metrics` the timings.
+    """
+
+    def __init__(self, client, prompt, model="gpt-4o", max_tokens=600):
+        self.client = client
+        self.prompt = prompt
+        self.model = model
+        self.max_tokens = max_tokens
+        self.text = ""
+        self.metrics = {}
+
+    def __iter__(self):
+        start = time.perf_counter_ns()
+        arrivals = []
+        usage = None
+        pieces = []
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": self.prompt}],
+                temperature=0.7,
+                max_tokens=self.max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                arrivals.append(time.perf_counter_ns())
+                pieces.append(chunk.choices[0].delta.content)
+                yield pieces[-1]
+        except Exception as e:
+            pieces.append(f"Error generating response: {str(e)}")
+            yield pieces[-1]
+        end = time.perf_counter_ns()
+        self.text = "".join(pieces)
+        latency_recorder.record("generation", end - start)
+        if arrivals:
+            latency_recorder.record("generation.ttft", arrivals[0] - start)
+
+        # Sin `usage` en el stream, cada fragmento se cuenta como un token
+        tokens = usage.completion_tokens if usage is not None else len(arrivals)
+        first = arrivals[0] if arrivals else end
+        decode_time = (end - first) / 1e9
+        self.metrics = {
+            'generation_time': (end - start) / 1e9,
+            'ttft': (first - start) / 1e9,
+            'inter_token_latency': float(np.mean(np.diff(arrivals))) / 1e9 if len(arrivals) > 1 else 0.0,
+            'tokens_per_second': (tokens - 1) / decode_time if tokens > 1 and decode_time > 0 else 0.0,
+            'output_tokens': tokens,
+        }
+
+def stream_response_with_metrics(client, query, context_docs):
+    """Streaming counterpart of generate_response_with_metrics: returns a GenerationStream to iterate"""
+    return GenerationStream(client, _generation_prompt(query, context_docs))
+
+@timed("generation")
+async def generate_response_async(client, query, context_docs):
+    """Async generate_response_with_metrics for the headless runner; errors are raised, not returned as text"""
+    start_time = time.time()
+    response = await client.chat.completions.create(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": _generation_prompt(query, context_docs)}],
+        temperature=0.7,
+        max_tokens=600
+    )
+    return response.choices[0].message.content, time.time() - start_time
+
+SAMPLE_DOCUMENTS = [
+    "La inteligencia artificial es una rama de la informática que busca crear máquinas capaces de realizar tareas que requieren inteligencia humana.",
+    "Los modelos de lenguaje grande (LLM) son sistemas de IA entrenados en enormes cantidades de texto para generar y comprender lenguaje natural.",
+    "RAG (Retrieval-Augmented Generation) combina la búsqueda de información relevante con la generación de texto para producir respuestas más precisas.",
+    "LangChain es un framework que facilita el desarrollo de aplicaciones con modelos de lenguaje, proporcionando herramientas para cadenas y agentes.",
+    "El prompt engineering es la práctica de diseñar instrucciones efectivas para obtener los mejores resultados de los modelos de IA.",
+    "Los embeddings son representaciones vectoriales de texto que capturan el significado semántico en un espacio multidimensional.",
+    "La búsqueda semántica utiliza embeddings para encontrar contenido relacionado por significado, no solo por palabras clave.",
+    "Los sistemas de evaluación de IA miden métricas como relevancia, fidelidad y precisión del contexto."
+]
+
 def create_evaluation_dataset():
     return [
         {
@@ -264,9 +1726,109 @@ def create_evaluation_dataset():
         }
     ]
 
+# --- Registro de interacciones en disco ---
+INTERACTION_LOG_DIR = os.getenv(
+    "RAG_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".rag_logs")
+)
+# Interacciones que se conservan en memoria por sesión para los gráficos del dashboard
+RECENT_INTERACTIONS = int(os.getenv("RAG_RECENT_INTERACTIONS", "500"))
+
+def _json_default(value):
+    # Escalares de NumPy (p. ej. puntuaciones float32) en las métricas
+    return value.item() if hasattr(value, "item") else str(value)
+
+class InteractionLog:
+    """Append-only JSONL log shared by every session, rotated by size.
+
+    Writes go through a file buffer that a background thread flushes at most
+    `flush_interval` seconds after they are written (and on rotation, export and exit). When the active file reaches
+    `max_bytes` it is renamed with a timestamp, so sorting the file names gives
+    chronological order, and only the newest `backups` rotated files are kept
+    (0 keeps all of them).
+    """
+
+    def __init__(self, directory=None, max_bytes=None, backups=None, buffer_size=1 << 16, flush_interval=1.0):
+        self.directory = directory or INTERACTION_LOG_DIR
+        self.max_bytes = max_bytes or int(os.getenv("RAG_LOG_MAX_BYTES", str(50 << 20)))
+        self.backups = int(os.getenv("RAG_LOG_BACKUPS", "20")) if backups is None else backups
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.path = os.path.join(self.directory, "interactions.jsonl")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._dirty = False  # Hay líneas en el búfer sin volcar
+        self._closed = threading.Event()
+        self._open()
+        threading.Thread(target=self._flush_periodically, name="interaction-log-flush", daemon=True).start()
+
+    def _open(self):
+        self._file = open(self.path, "ab", buffering=self.buffer_size)
+        self.size = self._file.tell()
+
+    def append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8")
+        with self._lock:
+            self._file.write(line)
+            self.size += len(line)
+            self._dirty = True
+            if self.size >= self.max_bytes:
+                self._rotate()
+
+    def _flush_periodically(self):
+        # Lo escrito llega a disco aunque no vuelva a haber consultas
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def _rotate(self):
+        self._file.close()
+        self._dirty = False
+        os.replace(self.path, os.path.join(
+            self.directory, f"interactions.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl"
+        ))
+        if self.backups:
+            for old in self.rotated_files()[:-self.backups]:
+                os.remove(old)
+        self._open()
+
+    def rotated_files(self):
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.startswith("interactions.") and name != "interactions.jsonl" and name.endswith(".jsonl")
+        )
+
+    def flush(self):
+        with self._lock:
+            if self._dirty and not self._file.closed:
+                self._file.flush()
+                self._dirty = False
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._file.close()
+
+    def __iter__(self):
+        """Every logged entry, oldest first, read one line at a time"""
+        self.flush()
+        for path in self.rotated_files() + [self.path]:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+            except FileNotFoundError:
+                # Rotado o eliminado mientras se leía
+                continue
+
+@st.cache_resource
+def get_interaction_log():
+    log = InteractionLog()
+    atexit.register(log.close)
+    return log
+
 def log_interaction(query, response, metrics, context_docs):
     if 'interaction_logs' not in st.session_state:
-        st.session_state.interaction_logs = []
+        st.session_state.interaction_logs = collections.deque(maxlen=RECENT_INTERACTIONS)
     
     log_entry = {
         'id': str(uuid.uuid4()),
@@ -275,56 +1837,65 @@ def log_interaction(query, response, metrics, context_docs):
         'response': response,
         'metrics': metrics,
         'context_count': len(context_docs),
-        'context_scores': [doc.get('combined_score', 0) for doc in context_docs]
+        'context_scores': [float(doc.get('combined_score', 0)) for doc in context_docs]
     }
     
+    # El histórico completo va a disco; en la sesión solo quedan las interacciones recientes
+    get_interaction_log().append(log_entry)
     st.session_state.interaction_logs.append(log_entry)
 
+def langsmith_record(log):
+    return {
+        "run_id": log['id'],
+        "timestamp": log['timestamp'],
+        "inputs": {"query": log['query']},
+        "outputs": {"response": log['response']},
+        "metrics": log['metrics'],
+        "metadata": {
+            "context_count": log['context_count'],
+            "context_scores": log['context_scores']
+        }
+    }
+
 def export_langsmith_format(logs):
-    langsmith_data = []
+    return [langsmith_record(log) for log in logs]
+
+def export_langsmith_stream(logs, output):
+    """Write `logs` (any iterable, e.g. an InteractionLog) to the text file `output` as a
+    LangSmith JSON array, one record at a time. Returns the number of records."""
+    count = 0
+    output.write("[")
     for log in logs:
-        langsmith_data.append({
-            "run_id": log['id'],
-            "timestamp": log['timestamp'],
-            "inputs": {"query": log['query']},
-            "outputs": {"response": log['response']},
-            "metrics": log['metrics'],
-            "metadata": {
-                "context_count": log['context_count'],
-                "context_scores": log['context_scores']
-            }
-        })
-    return langsmith_data
+        output.write(",\n" if count else "\n")
+        output.write(json.dumps(langsmith_record(log), ensure_ascii=False, default=_json_default))
+        count += 1
+    output.write("\n]\n")
+    return count
 
 def main():
+    st.set_page_config(page_title="RAG Evaluation", page_icon="📊", layout="wide")
     st.title("📊 RAG con Evaluación y Monitoreo (LangChain)")
     st.write("Sistema RAG con métricas detalladas usando LangChain para embeddings")
     
     # Check if GitHub token is available
     if not github_token:
-        st.error("❌ Please check your .env file and make sure GITHUB_TOKEN is set.")
-        st.info("💡 Your .env file should contain: GITHUB_TOKEN=your_token_here")
-        return
+        st.error("❌ GITHUB_TOKEN environment variable is not set. Please check your .env file.")
+        st.info("💡 Make sure your .env file contains: GITHUB_TOKEN=your_token_here")
+        st.stop()
     
     if "eval_rag" not in st.session_state:
         st.session_state.eval_rag = {
-            'documents': [
-                "La inteligencia artificial es una rama de la informática que busca crear máquinas capaces de realizar tareas que requieren inteligencia humana.",
-                "Los modelos de lenguaje grande (LLM) son sistemas de IA entrenados en enormes cantidades de texto para generar y comprender lenguaje natural.",
-                "RAG (Retrieval-Augmented Generation) combina la búsqueda de información relevante con la generación de texto para producir respuestas más precisas.",
-                "LangChain es un framework que facilita el desarrollo de aplicaciones con modelos de lenguaje, proporcionando herramientas para cadenas y agentes.",
-                "El prompt engineering es la práctica de diseñar instrucciones efectivas para obtener los mejores resultados de los modelos de IA.",
-                "Los embeddings son representaciones vectoriales de texto que capturan el significado semántico en un espacio multidimensional.",
-                "La búsqueda semántica utiliza embeddings para encontrar contenido relacionado por significado, no solo por palabras clave.",
-                "Los sistemas de evaluación de IA miden métricas como relevancia, fidelidad y precisión del contexto."
-            ],
+            'documents': list(SAMPLE_DOCUMENTS),
             'embeddings': None,
             'embeddings_model': None,
             'enable_logging': True
         }
     
+    if 'keyword_index' not in st.session_state.eval_rag:
+        st.session_state.eval_rag['keyword_index'] = BM25Index.from_documents(st.session_state.eval_rag['documents'])
+    
     if 'interaction_logs' not in st.session_state:
-        st.session_state.interaction_logs = []
+        st.session_state.interaction_logs = collections.deque(maxlen=RECENT_INTERACTIONS)
     
     client = initialize_client()
     if not client:
@@ -338,6 +1909,13 @@ def main():
         except Exception as e:
             st.error(f"Error inicializando embeddings: {str(e)}")
     
+    # Si todos los documentos ya están en la caché de disco no hace falta llamar a la API
+    if st.session_state.eval_rag['embeddings'] is None:
+        st.session_state.eval_rag['embeddings'] = load_cached_embeddings(
+            st.session_state.eval_rag['embeddings_model'],
+            st.session_state.eval_rag['documents']
+        )
+    
     tab1, tab2, tab3, tab4, tab5 = st.tabs(["🔍 Consulta", "📄 Documentos", "📊 Métricas", "🧪 Evaluación", "📈 Analytics"])
     
     with tab1:
@@ -353,6 +1931,7 @@ def main():
                 top_k = st.slider("Docs a recuperar:", 1, 8, 3)
             with col_b:
                 eval_enabled = st.checkbox("Evaluación automática", value=True)
+                streaming = st.checkbox("Streaming", value=True, help="Muestra la respuesta según llegan los tokens")
             with col_c:
                 st.session_state.eval_rag['enable_logging'] = st.checkbox("Logging", value=True)
         
@@ -365,7 +1944,7 @@ def main():
                             st.session_state.eval_rag['documents']
                         )
                         if embeddings is not None:
-                            st.session_state.eval_rag['embeddings'] = embeddings
+                            st.session_state.eval_rag['embeddings'] = EmbeddingMatrix.from_array(embeddings)
                             st.success("✅ Embeddings listos con LangChain")
                         else:
                             st.error("❌ Error generando embeddings")
@@ -385,62 +1964,80 @@ def main():
                         st.session_state.eval_rag['embeddings'],
                         st.session_state.eval_rag['embeddings_model'],
                         client,
-                        top_k
+                        top_k,
+                        st.session_state.eval_rag['keyword_index']
                     )
                     
                     if not results:
                         st.error("Error en la búsqueda")
                         return
-                    
-                    response, generation_time = generate_response_with_metrics(client, query, results)
-                    
-                    metrics = {
-                        'retrieval_time': retrieval_time,
-                        'generation_time': generation_time,
-                        'total_time': retrieval_time + generation_time,
-                        'docs_retrieved': len(results),
-                        'avg_relevance_score': np.mean([r['combined_score'] for r in results])
-                    }
-                    
-                    if eval_enabled:
-                        context_text = "".join([r['document'] for r in results])
-                        
-                        with st.spinner("Evaluando calidad..."):
-                            metrics['faithfulness'] = evaluate_faithfulness(client, query, context_text, response)
-                            metrics['relevance'] = evaluate_relevance(client, query, response)
-                            metrics['context_precision'] = evaluate_context_precision(client, query, results)
-                    
-                    st.subheader("📋 Documentos Recuperados")
-                    for i, result in enumerate(results):
-                        with st.expander(f"Doc {i+1} - Score: {result['combined_score']:.3f}"):
-                            st.write(result['document'])
-                    
-                    st.subheader("🤖 Respuesta")
+                
+                st.subheader("📋 Documentos Recuperados")
+                for i, result in enumerate(results):
+                    with st.expander(f"Doc {i+1} - Score: {result['combined_score']:.3f}"):
+                        st.write(result['document'])
+                
+                st.subheader("🤖 Respuesta")
+                if streaming and client:
+                    # Los tokens se pintan según llegan; las latencias se miden durante la iteración
+                    stream = stream_response_with_metrics(client, query, results)
+                    st.write_stream(stream)
+                    response, generation_metrics = stream.text, stream.metrics
+                else:
+                    with st.spinner("Generando respuesta..."):
+                        response, generation_time = generate_response_with_metrics(client, query, results)
+                    generation_metrics = {'generation_time': generation_time}
                     st.write(response)
+                
+                metrics = {
+                    'retrieval_time': retrieval_time,
+                    **generation_metrics,
+                    'total_time': retrieval_time + generation_metrics['generation_time'],
+                    'docs_retrieved': len(results),
+                    'avg_relevance_score': np.mean([r['combined_score'] for r in results])
+                }
+                
+                if eval_enabled:
+                    context_text = "".join([r['document'] for r in results])
                     
-                    st.subheader("⏱️ Métricas de Rendimiento")
+                    with st.spinner("Evaluando calidad..."):
+                        # Los tres jueces (y cada documento de la precisión) se consultan en paralelo
+                        metrics.update(evaluate_response(query, context_text, response, results))
+                
+                st.subheader("⏱️ Métricas de Rendimiento")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Tiempo total", f"{metrics['total_time']:.2f}s")
+                with col2:
+                    st.metric("Recuperación", f"{metrics['retrieval_time']:.2f}s")
+                with col3:
+                    st.metric("Generación", f"{metrics['generation_time']:.2f}s")
+                with col4:
+                    st.metric("Docs recuperados", metrics['docs_retrieved'])
+                
+                if 'ttft' in metrics:
                     col1, col2, col3, col4 = st.columns(4)
                     with col1:
-                        st.metric("Tiempo total", f"{metrics['total_time']:.2f}s")
+                        st.metric("Primer token", f"{metrics['ttft']:.2f}s")
                     with col2:
-                        st.metric("Recuperación", f"{metrics['retrieval_time']:.2f}s")
+                        st.metric("Entre tokens", f"{1000 * metrics['inter_token_latency']:.0f} ms")
                     with col3:
-                        st.metric("Generación", f"{metrics['generation_time']:.2f}s")
+                        st.metric("Tokens/s", f"{metrics['tokens_per_second']:.1f}")
                     with col4:
-                        st.metric("Docs recuperados", metrics['docs_retrieved'])
-                    
-                    if eval_enabled:
-                        st.subheader("🎯 Métricas de Calidad")
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Fidelidad", f"{metrics['faithfulness']:.1f}/10")
-                        with col2:
-                            st.metric("Relevancia", f"{metrics['relevance']:.1f}/10")
-                        with col3:
-                            st.metric("Precisión contexto", f"{metrics['context_precision']:.2f}")
-                    
-                    if st.session_state.eval_rag['enable_logging']:
-                        log_interaction(query, response, metrics, results)
+                        st.metric("Tokens generados", metrics['output_tokens'])
+                
+                if eval_enabled:
+                    st.subheader("🎯 Métricas de Calidad")
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Fidelidad", f"{metrics['faithfulness']:.1f}/10")
+                    with col2:
+                        st.metric("Relevancia", f"{metrics['relevance']:.1f}/10")
+                    with col3:
+                        st.metric("Precisión contexto", f"{metrics['context_precision']:.2f}")
+                
+                if st.session_state.eval_rag['enable_logging']:
+                    log_interaction(query, response, metrics, results)
     
     with tab2:
         st.header("📄 Gestión de Documentos")
@@ -469,9 +2066,8 @@ def main():
                     
                     with col_delete:
                         if st.button(f"🗑️ Eliminar", key=f"delete_{i}"):
-                            st.session_state.eval_rag['documents'].pop(i)
-                            # Reset embeddings when documents change
-                            st.session_state.eval_rag['embeddings'] = None
+                            # Solo se marca la fila como borrada; no hay que regenerar embeddings
+                            delete_document(st.session_state.eval_rag, i)
                             st.rerun()
                     
                     # Edit mode
@@ -486,10 +2082,9 @@ def main():
                         col_save, col_cancel = st.columns(2)
                         with col_save:
                             if st.button(f"💾 Guardar", key=f"save_{i}"):
-                                st.session_state.eval_rag['documents'][i] = new_content
+                                # Se re-embebe solo el documento editado
+                                update_document(st.session_state.eval_rag, i, new_content)
                                 st.session_state[f'editing_doc_{i}'] = False
-                                # Reset embeddings when documents change
-                                st.session_state.eval_rag['embeddings'] = None
                                 st.success("Documento actualizado")
                                 st.rerun()
                         
@@ -509,9 +2104,7 @@ def main():
             
             if st.button("📝 Agregar Documento"):
                 if new_doc.strip():
-                    st.session_state.eval_rag['documents'].append(new_doc.strip())
-                    # Reset embeddings when documents change
-                    st.session_state.eval_rag['embeddings'] = None
+                    add_document(st.session_state.eval_rag, new_doc.strip())
                     st.success("Documento agregado exitosamente")
                     st.rerun()
                 else:
@@ -533,6 +2126,7 @@ def main():
                 if st.session_state.eval_rag['documents']:
                     st.session_state.eval_rag['documents'] = []
                     st.session_state.eval_rag['embeddings'] = None
+                    st.session_state.eval_rag['keyword_index'] = BM25Index()
                     st.success("Todos los documentos eliminados")
                     st.rerun()
             
@@ -547,8 +2141,7 @@ def main():
                 try:
                     content = uploaded_file.read().decode('utf-8')
                     if st.button("📥 Importar Archivo"):
-                        st.session_state.eval_rag['documents'].append(content)
-                        st.session_state.eval_rag['embeddings'] = None
+                        add_document(st.session_state.eval_rag, content)
                         st.success(f"Archivo '{uploaded_file.name}' importado exitosamente")
                         st.rerun()
                 except Exception as e:
@@ -565,6 +2158,33 @@ def main():
     with tab3:
         st.header("📊 Dashboard de Métricas")
         
+        st.subheader("🗃️ Caché de consultas")
+        query_cache_stats = get_query_cache().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Aciertos", query_cache_stats['hits'])
+        with col2:
+            st.metric("Fallos", query_cache_stats['misses'])
+        with col3:
+            st.metric("Tasa de aciertos", f"{query_cache_stats['hit_rate']:.0%}")
+        with col4:
+            st.metric("Consultas en caché", query_cache_stats['size'])
+        
+        st.subheader("⏱️ Latencia por etapa")
+        latency_stats = latency_recorder.snapshot()
+        if latency_stats:
+            st.dataframe(pd.DataFrame(latency_stats).T.round(3))
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("📥 Exportar histogramas (JSON)", latency_recorder.to_json(),
+                                   file_name="rag_latency.json", mime="application/json")
+            with col2:
+                if st.button("🔄 Reiniciar latencias"):
+                    latency_recorder.reset()
+                    st.rerun()
+        else:
+            st.info("Sin muestras de latencia todavía.")
+        
         if st.session_state.interaction_logs:
             df = pd.DataFrame([
                 {
@@ -612,6 +2232,18 @@ def main():
             with col4:
                 if 'relevance' in df.columns:
                     st.metric("Average Relevance", f"{df['relevance'].mean():.1f}/10")
+            
+            if 'ttft' in df.columns and df['ttft'].notna().any():
+                st.subheader("⚡ Perceived Latency")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("TTFT p50", f"{df['ttft'].median():.2f}s")
+                with col2:
+                    st.metric("TTFT p95", f"{df['ttft'].quantile(0.95):.2f}s")
+                with col3:
+                    st.metric("Inter-token", f"{1000 * df['inter_token_latency'].mean():.0f} ms")
+                with col4:
+                    st.metric("Tokens/s", f"{df['tokens_per_second'].mean():.1f}")
         else:
             st.info("No hay datos de interacciones aún. Realiza algunas consultas primero.")
     
@@ -626,38 +2258,43 @@ def main():
             else:
                 eval_dataset = create_evaluation_dataset()
                 results = []
+                judge_cache_stats = None
                 
                 with st.spinner("Ejecutando evaluación sistemática..."):
-                    for test_case in eval_dataset:
+                    # Recuperación de todas las consultas en lote; el tiempo se reparte entre ellas
+                    all_docs, total_retrieval_time = hybrid_search_many(
+                        [test_case['query'] for test_case in eval_dataset],
+                        st.session_state.eval_rag['documents'],
+                        st.session_state.eval_rag['embeddings'],
+                        st.session_state.eval_rag['embeddings_model'],
+                        3,
+                        st.session_state.eval_rag['keyword_index']
+                    )
+                    retrieval_time = total_retrieval_time / len(eval_dataset)
+                    
+                    cases = []
+                    for test_case, docs in zip(eval_dataset, all_docs):
                         query = test_case['query']
                         
-                        docs, retrieval_time = hybrid_search_with_metrics(
-                            query,
-                            st.session_state.eval_rag['documents'],
-                            st.session_state.eval_rag['embeddings'],
-                            st.session_state.eval_rag['embeddings_model'],
-                            client,
-                            3
-                        )
-                        
                         if docs:
                             response, generation_time = generate_response_with_metrics(client, query, docs)
                             
                             context_text = "".join([d['document'] for d in docs])
-                            faithfulness = evaluate_faithfulness(client, query, context_text, response)
-                            relevance = evaluate_relevance(client, query, response)
-                            context_precision = evaluate_context_precision(client, query, docs)
+                            cases.append((query, context_text, response, docs))
                             
                             results.append({
                                 'query': query,
                                 'response': response,
                                 'retrieval_time': retrieval_time,
                                 'generation_time': generation_time,
-                                'faithfulness': faithfulness,
-                                'relevance': relevance,
-                                'context_precision': context_precision,
                                 'ground_truth': test_case['ground_truth']
                             })
+                    
+                    # Todos los jueces de todos los casos comparten el límite de concurrencia y de peticiones por minuto
+                    cache_before = get_judge_cache().stats()
+                    for result, scores in zip(results, evaluate_many(cases)):
+                        result.update(scores)
+                    judge_cache_stats = judge_cache_delta(cache_before, get_judge_cache().stats())
                 
                 if results:
                     st.subheader("📊 Resultados de Evaluación")
@@ -674,6 +2311,11 @@ def main():
                         st.metric("Precisión", f"{eval_df['context_precision'].mean():.2f}")
                     with col4:
                         st.metric("Tiempo total", f"{(eval_df['retrieval_time'] + eval_df['generation_time']).mean():.2f}s")
+                    
+                    if judge_cache_stats and judge_cache_stats['total']['hits'] + judge_cache_stats['total']['misses']:
+                        st.subheader("🗄️ Caché de Jueces")
+                        st.caption(f"Tasa de aciertos: {judge_cache_stats['total']['hit_rate']:.1%} — solo se pagan los casos que cambiaron")
+                        st.dataframe(pd.DataFrame(judge_cache_stats).T)
                 else:
                     st.error("No se pudieron obtener resultados de evaluación")
     
@@ -686,17 +2328,20 @@ def main():
             st.subheader("📤 Exportar Datos")
             
             if st.button("📊 Exportar para LangSmith"):
+                # Solo las interacciones recientes de esta sesión: el registro completo de
+                # todas las sesiones se exporta sin interfaz con el comando export-langsmith
                 if st.session_state.interaction_logs:
                     langsmith_data = export_langsmith_format(st.session_state.interaction_logs)
                     st.json(langsmith_data[:2])
                     
-                    json_str = json.dumps(langsmith_data, indent=2, ensure_ascii=False)
+                    json_str = json.dumps(langsmith_data, indent=2, ensure_ascii=False, default=_json_default)
                     st.download_button(
                         label="💾 Descargar JSON LangSmith",
                         data=json_str,
                         file_name=f"langsmith_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                         mime="application/json"
                     )
+                    st.caption(f"{len(langsmith_data)} interacciones de esta sesión; el histórico completo se exporta con `export-langsmith`")
                 else:
                     st.info("No hay datos para exportar")
             
@@ -756,5 +2401,275 @@ def main():
             else:
                 st.info("No documents available for analysis")
 
+# --- Benchmark de recuperación (sin interfaz) ---
+def _retrieval_baseline(query_embedding, embeddings, top_k):
+    # Implementación anterior: cosine_similarity sobre float64 y argsort completo
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    scores = cosine_similarity([query_embedding], embeddings)[0]
+    return np.argsort(scores)[::-1][:top_k]
+
+def _retrieval_current(query_embedding, matrix, top_k):
+    return top_k_indices(matrix.similarities(query_embedding), top_k)
+
+def _retrieval_ann(query_embedding, matrix, top_k):
+    return matrix.row_positions()[matrix.ann.search(normalize_rows(query_embedding), top_k)[0]]
+
+def _clustered_vectors(rng, size, dim, clusters=256):
+    # Mezcla de gaussianas: los embeddings reales se agrupan por temas, no son ruido uniforme
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = rng.standard_normal((size, dim), dtype=np.float32) * 0.6
+    vectors += centers[rng.integers(0, clusters, size)]
+    return vectors
+
+def bench_retrieval(sizes=(10_000, 100_000, 1_000_000), dim=384, queries=50, top_k=5, baseline=True,
+                    ann=True, nlist=None, nprobe=None, seed=0):
+    """Per-query semantic scoring + top-k latency over clustered random vectors:
+    previous implementation, exact search and IVF (with its recall against exact)"""
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        vectors = _clustered_vectors(rng, size, dim)
+        query_embeddings = _clustered_vectors(rng, queries, dim)
+        matrix = EmbeddingMatrix.from_array(vectors)
+        runs = [("current", _retrieval_current, matrix)]
+        if baseline:
+            runs.insert(0, ("baseline", _retrieval_baseline, vectors.astype(np.float64)))
+        if ann:
+            start = time.perf_counter()
+            matrix.ann = IVFIndex(matrix, nlist, nprobe)
+            build_time = time.perf_counter() - start
+            runs.append(("ivf", _retrieval_ann, matrix))
+        del vectors
+        exact = [set(_retrieval_current(q, matrix, top_k).tolist()) for q in query_embeddings]
+        for name, search, index in runs:
+            search(query_embeddings[0], index, top_k)
+            timings, hits = [], 0
+            for query_embedding, expected in zip(query_embeddings, exact):
+                start = time.perf_counter()
+                found = search(query_embedding, index, top_k)
+                timings.append(time.perf_counter() - start)
+                hits += len(expected.intersection(np.asarray(found).tolist()))
+            result = {
+                "implementation": name,
+                "vectors": size,
+                "dim": dim,
+                "mean_ms": round(1000 * float(np.mean(timings)), 3),
+                "p50_ms": round(1000 * float(np.percentile(timings, 50)), 3),
+                "p95_ms": round(1000 * float(np.percentile(timings, 95)), 3),
+                "recall": round(hits / (len(exact) * min(top_k, size)), 4),
+            }
+            if name == "ivf":
+                result.update(nlist=matrix.ann.nlist, nprobe=matrix.ann.nprobe, build_s=round(build_time, 2))
+            results.append(result)
+            print(f"{name:<9} {size:>9} vectores  media {result['mean_ms']:>9} ms  "
+                  f"p95 {result['p95_ms']:>9} ms  recall {result['recall']}", file=sys.stderr)
+        del runs, index, matrix
+    return results
+
+# --- Evaluación sin interfaz sobre datasets JSONL ---
+def iter_evaluation_cases(path):
+    """Stream test cases from a JSONL file; cases without an 'id' get their line number"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                case = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: JSON no válido ({e})") from e
+            if "query" not in case:
+                raise ValueError(f"{path}:{line_number}: falta el campo 'query'")
+            case.setdefault("id", line_number)
+            yield case
+
+def load_documents(path):
+    """Documents for the headless runner: JSONL with a 'text' (or 'document') field, or one per line"""
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [(record.get("text") or record.get("document")) for record in map(json.loads, lines)]
+    return lines
+
+def completed_evaluation_ids(path):
+    """Ids already written to an output JSONL. A line cut short by a crash is truncated away
+    so the resumed run appends after the last complete record."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        # El último salto de línea se busca leyendo bloques desde el final del archivo
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - (1 << 16))
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+        f.seek(0)
+        return {str(json.loads(line)["id"]) for line in f if line.strip()}
+
+async def run_evaluation_async(cases, output, documents, embeddings, embeddings_model, keyword_index, client,
+                               workers, top_k=3, batch_size=64, stats=None):
+    """Retrieval, generation and judging as a pipeline: retrieval runs in batches on a thread
+    while `workers` coroutines generate and judge, and each result is appended to `output`
+    as soon as it is complete. The bounded queue keeps memory constant."""
+    stats = stats if stats is not None else collections.Counter()
+    # Un juez fallido hace fallar el caso en vez de guardar una puntuación por defecto
+    engine = JudgeEngine(client, strict=True)
+    queue = asyncio.Queue(maxsize=2 * workers)
+
+    async def retrieve(batch):
+        all_docs, total_time = await asyncio.to_thread(
+            hybrid_search_many, [case["query"] for case in batch], documents, embeddings,
+            embeddings_model, top_k, keyword_index
+        )
+        for case, docs in zip(batch, all_docs):
+            await queue.put((case, docs, total_time / len(batch)))
+
+    async def produce():
+        batch = []
+        for case in cases:
+            batch.append(case)
+            if len(batch) == batch_size:
+                await retrieve(batch)
+                batch = []
+        if batch:
+            await retrieve(batch)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def work():
+        while (item := await queue.get()) is not None:
+            case, docs, retrieval_time = item
+            try:
+                if not docs:
+                    raise RuntimeError("sin documentos recuperados")
+                response, generation_time = await generate_response_async(client, case["query"], docs)
+                scores = await engine.evaluate(case["query"], "".join(d['document'] for d in docs), response, docs)
+            except Exception as e:
+                # Los casos fallidos no se escriben: la siguiente ejecución los vuelve a intentar
+                stats["failed"] += 1
+                print(f"caso {case['id']}: {e}", file=sys.stderr)
+                continue
+            record = {
+                'id': case["id"],
+                'query': case["query"],
+                'response': response,
+                'ground_truth': case.get("ground_truth"),
+                'retrieved': [int(doc['index']) for doc in docs],
+                'retrieval_time': retrieval_time,
+                'generation_time': generation_time,
+                **scores
+            }
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            stats["completed"] += 1
+            if stats["completed"] % 100 == 0:
+                print(f"{stats['completed']} casos evaluados", file=sys.stderr)
+
+    await asyncio.gather(produce(), *(work() for _ in range(workers)))
+    return stats
+
+def run_evaluation(dataset_path, output_path, documents=None, embeddings_model=None, client=None,
+                   workers=None, top_k=3, batch_size=64):
+    """Evaluate every case of a JSONL dataset, appending results to `output_path` and skipping
+    the ids it already contains, so an interrupted run resumes where it stopped"""
+    documents = documents or list(SAMPLE_DOCUMENTS)
+    embeddings_model = embeddings_model or initialize_embeddings()
+    client = client or AsyncOpenAI(base_url=github_base_url, api_key=github_token)
+    embeddings = get_embeddings_langchain(embeddings_model, documents)
+    if embeddings is None:
+        raise RuntimeError("no se pudieron obtener los embeddings de los documentos")
+    embeddings = EmbeddingMatrix.from_array(embeddings)
+    keyword_index = BM25Index.from_documents(documents)
+
+    done = completed_evaluation_ids(output_path)
+    stats = collections.Counter(skipped=0)
+
+    def pending():
+        for case in iter_evaluation_cases(dataset_path):
+            if str(case["id"]) in done:
+                stats["skipped"] += 1
+            else:
+                yield case
+
+    cache_before = get_judge_cache().stats()
+    start = time.time()
+    with open(output_path, "a", encoding="utf-8") as output:
+        asyncio.run(run_evaluation_async(
+            pending(), output, documents, embeddings, embeddings_model, keyword_index, client,
+            workers or JUDGE_CONCURRENCY, top_k, batch_size, stats
+        ))
+    stats["elapsed_s"] = round(time.time() - start, 2)
+    stats["judge_cache_hit_rate"] = judge_cache_delta(cache_before, get_judge_cache().stats())['total']['hit_rate']
+    return dict(stats)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Herramientas del evaluador RAG sin interfaz")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = commands.add_parser("bench-retrieval", help="Latencia por consulta de la búsqueda semántica")
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    bench_parser.add_argument("--dim", type=int, default=384)
+    bench_parser.add_argument("--queries", type=int, default=50)
+    bench_parser.add_argument("--top-k", type=int, default=5)
+    bench_parser.add_argument("--no-baseline", action="store_true", help="Omite la implementación anterior (float64)")
+    bench_parser.add_argument("--no-ann", action="store_true", help="Omite el índice IVF")
+    bench_parser.add_argument("--nlist", type=int, help="Listas del índice IVF (por defecto, raíz del número de vectores)")
+    bench_parser.add_argument("--nprobe", type=int, help="Listas visitadas por consulta")
+    bench_parser.add_argument("--output", "-o", help="Guarda los resultados en JSON")
+
+    eval_parser = commands.add_parser("evaluate", help="Evalúa un dataset JSONL y escribe un resultado por línea")
+    eval_parser.add_argument("dataset", help="JSONL con 'query' y opcionalmente 'id' y 'ground_truth'")
+    eval_parser.add_argument("--output", "-o", required=True, help="JSONL de resultados; si existe se reanuda")
+    eval_parser.add_argument("--documents", help="Corpus: JSONL con campo 'text' o un documento por línea")
+    eval_parser.add_argument("--workers", type=int, default=JUDGE_CONCURRENCY, help="Casos en vuelo a la vez")
+    eval_parser.add_argument("--top-k", type=int, default=3)
+    eval_parser.add_argument("--batch-size", type=int, default=64, help="Consultas por lote de recuperación")
+    eval_parser.add_argument("--latency-output", help="Guarda los histogramas de latencia por etapa en JSON")
+
+    export_parser = commands.add_parser("export-langsmith", help="Convierte el registro de interacciones al formato de LangSmith")
+    export_parser.add_argument("--log-dir", default=INTERACTION_LOG_DIR, help="Directorio del registro de interacciones")
+    export_parser.add_argument("--output", "-o", help="Fichero JSON de salida (por defecto, salida estándar)")
+
+    args = parser.parse_args(argv)
+    if args.command == "evaluate":
+        if not github_token:
+            parser.error("GITHUB_TOKEN no está definido")
+        documents = load_documents(args.documents) if args.documents else None
+        summary = run_evaluation(args.dataset, args.output, documents, workers=args.workers,
+                                 top_k=args.top_k, batch_size=args.batch_size)
+        print(json.dumps(summary), file=sys.stderr)
+        if args.latency_output:
+            with open(args.latency_output, "w", encoding="utf-8") as f:
+                f.write(latency_recorder.to_json())
+        return 1 if summary.get("failed") else 0
+    if args.command == "export-langsmith":
+        interaction_log = InteractionLog(args.log_dir)
+        try:
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    count = export_langsmith_stream(interaction_log, f)
+            else:
+                count = export_langsmith_stream(interaction_log, sys.stdout)
+        finally:
+            interaction_log.close()
+        print(f"{count} interacciones exportadas", file=sys.stderr)
+        return 0
+    if args.command == "bench-retrieval":
+        results = bench_retrieval(args.sizes, args.dim, args.queries, args.top_k, not args.no_baseline,
+                                  not args.no_ann, args.nlist, args.nprobe)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
 if __name__ == "__main__":
-    main()
+    # `streamlit run` ejecuta el script sin argumentos: en ese caso se abre la interfaz
+    if len(sys.argv) > 1:
+        sys.exit(cli())
+    else:
+        main()